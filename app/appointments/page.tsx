@@ -15,6 +15,7 @@ type Appointment = {
     owner_id: number;
     created_at: string;
     updated_at: string;
+    patient?: Patient | null;
   };
 
   type Patient = {
@@ -31,39 +32,39 @@ type Appointment = {
     
     useEffect(() => {
       fetchAppointments();
-      fetchPatients();
     }, []);
     
     const fetchAppointments = async () => {
       try {
         const token = localStorage.getItem('auth-token');
-        const response = await fetch(`${apiUrl}/appointments`, {
+        const response = await fetch(`${apiUrl}/appointments?expand=patient`, {
           headers: {
             'Authorization': `Bearer ${token}`
           }
         });
         const data = await response.json();
         setAppointments(data);
+        setLoading(false);
       } catch (error) {
         console.error('Error fetching appointments:', error);
+        setLoading(false);
       }
     };
     
+    // Patient names for the list come embedded via expand=patient; the full
+    // patient list is only needed for the form's patient picker
     const fetchPatients = async () => {
       try {
         const token = localStorage.getItem('auth-token');
-        const response = await fetch(`${apiUrl}/patients`, {
+        const response = await fetch(`${apiUrl}/patients?fields=id,name&limit=1000`, {
           headers: {
             'Authorization': `Bearer ${token}`
           }
         });
         const data = await response.json();
-        // Map to simpler format
-        setPatients(data.map((p: any) => ({ id: p.id, name: p.name })));
-        setLoading(false);
+        setPatients(data);
       } catch (error) {
         console.error('Error fetching patients:', error);
-        setLoading(false);
       }
     };
     
@@ -162,6 +163,7 @@ type Appointment = {
   };
 
   const handleEdit = (appointment: Appointment) => {
+    if (patients.length === 0) fetchPatients();
     setEditingAppointment(appointment);
     setFormData({
       patient_id: appointment.patient_id,
@@ -193,6 +195,7 @@ type Appointment = {
   };
 
   const openAddModal = () => {
+    if (patients.length === 0) fetchPatients();
     setEditingAppointment(null);
     setFormData({ patient_id: 0, date: '', time: '', doctor: '', reason: '', status: 'Scheduled' });
     setShowModal(true);
@@ -259,7 +262,7 @@ type Appointment = {
                     {appointments.map((appointment) => (
                       <tr key={appointment.id} className="hover:bg-gray-50 dark:hover:bg-gray-700">
                         <td className="px-6 py-4 whitespace-nowrap">
-                          <div className="text-sm font-medium text-gray-900 dark:text-white">{patients.find(p => p.id === appointment.patient_id)?.name || 'Unknown Patient'}</div>
+                          <div className="text-sm font-medium text-gray-900 dark:text-white">{appointment.patient?.name || patients.find(p => p.id === appointment.patient_id)?.name || 'Unknown Patient'}</div>
                         </td>
                         <td className="px-6 py-4 whitespace-nowrap">
                           <div className="text-sm text-gray-500 dark:text-gray-400">{appointment.date}</div>
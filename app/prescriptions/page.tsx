@@ -17,16 +17,19 @@ type Prescription = {
     status: 'Active' | 'Completed' | 'Cancelled';
     created_at: string;
     updated_at: string;
+    patient?: Patient | null;
   };
 
+  type Patient = {
+    id: number;
+    name: string;
+  };
+
+  // Only what the form's record picker shows
   type MedicalRecord = {
     id: number;
     patient_id: number;
-    date: string;
-    doctor: string;
-    diagnosis: string;
-    treatment: string;
-    status: string;
+    patient?: Patient | null;
   };
 
   export default function PrescriptionsPage() {
@@ -38,38 +41,39 @@ type Prescription = {
     
     useEffect(() => {
       fetchPrescriptions();
-      fetchMedicalRecords();
     }, []);
     
     const fetchPrescriptions = async () => {
       try {
         const token = localStorage.getItem('auth-token');
-        const response = await fetch(`${apiUrl}/prescriptions`, {
+        const response = await fetch(`${apiUrl}/prescriptions?expand=patient`, {
           headers: {
             'Authorization': `Bearer ${token}`
           }
         });
         const data = await response.json();
         setPrescriptions(data);
+        setLoading(false);
       } catch (error) {
         console.error('Error fetching prescriptions:', error);
+        setLoading(false);
       }
     };
     
+    // Patient names for the list come embedded via expand=patient; medical
+    // records are only needed for the form's record picker
     const fetchMedicalRecords = async () => {
       try {
         const token = localStorage.getItem('auth-token');
-        const response = await fetch(`${apiUrl}/records`, {
+        const response = await fetch(`${apiUrl}/records?fields=id,patient_id&expand=patient`, {
           headers: {
             'Authorization': `Bearer ${token}`
           }
         });
         const data = await response.json();
         setMedicalRecords(data);
-        setLoading(false);
       } catch (error) {
         console.error('Error fetching medical records:', error);
-        setLoading(false);
       }
     };
     
@@ -187,6 +191,7 @@ type Prescription = {
   };
 
   const handleEdit = (prescription: Prescription) => {
+    if (medicalRecords.length === 0) fetchMedicalRecords();
     setEditingPrescription(prescription);
     setFormData({
       record_id: prescription.record_id,
@@ -207,6 +212,7 @@ type Prescription = {
   };
 
   const openAddModal = () => {
+    if (medicalRecords.length === 0) fetchMedicalRecords();
     setEditingPrescription(null);
     setFormData({ 
       record_id: 0, 
@@ -289,7 +295,7 @@ type Prescription = {
                     {prescriptions.map((prescription) => (
                       <tr key={prescription.id} className="hover:bg-gray-50 dark:hover:bg-gray-700">
                         <td className="px-6 py-4 whitespace-nowrap">
-                          <div className="text-sm font-medium text-gray-900 dark:text-white">{medicalRecords.find(r => r.id === prescription.patient_id)?.patient_id || 'Unknown Patient'}</div>
+                          <div className="text-sm font-medium text-gray-900 dark:text-white">{prescription.patient?.name || 'Unknown Patient'}</div>
                         </td>
                         <td className="px-6 py-4 whitespace-nowrap">
                           <div className="text-sm text-gray-500 dark:text-gray-400">{prescription.medication}</div>
@@ -368,7 +374,7 @@ type Prescription = {
                   >
                     <option value={0}>Select Medical Record</option>
                     {medicalRecords.map(record => (
-                      <option key={record.id} value={record.id}>{medicalRecords.find(r => r.id === record.patient_id)?.patient_id || 'Patient'} (ID: {record.id})</option>
+                      <option key={record.id} value={record.id}>{record.patient?.name || 'Patient'} (ID: {record.id})</option>
                     ))}
                   </select>
                 </div>
@@ -15,6 +15,7 @@ type MedicalRecord = {
     status: string;
     created_at: string;
     updated_at: string;
+    patient?: Patient | null;
   };
 
   type Patient = {
@@ -31,39 +32,39 @@ type MedicalRecord = {
     
     useEffect(() => {
       fetchRecords();
-      fetchPatients();
     }, []);
     
     const fetchRecords = async () => {
       try {
         const token = localStorage.getItem('auth-token');
-        const response = await fetch(`${apiUrl}/records`, {
+        const response = await fetch(`${apiUrl}/records?expand=patient`, {
           headers: {
             'Authorization': `Bearer ${token}`
           }
         });
         const data = await response.json();
         setRecords(data);
+        setLoading(false);
       } catch (error) {
         console.error('Error fetching records:', error);
+        setLoading(false);
       }
     };
     
+    // Patient names for the list come embedded via expand=patient; the full
+    // patient list is only needed for the form's patient picker
     const fetchPatients = async () => {
       try {
         const token = localStorage.getItem('auth-token');
-        const response = await fetch(`${apiUrl}/patients`, {
+        const response = await fetch(`${apiUrl}/patients?fields=id,name&limit=1000`, {
           headers: {
             'Authorization': `Bearer ${token}`
           }
         });
         const data = await response.json();
-        // Map to simpler format
-        setPatients(data.map((p: any) => ({ id: p.id, name: p.name })));
-        setLoading(false);
+        setPatients(data);
       } catch (error) {
         console.error('Error fetching patients:', error);
-        setLoading(false);
       }
     };
     
@@ -157,6 +158,7 @@ type MedicalRecord = {
   };
 
   const handleEdit = (record: MedicalRecord) => {
+    if (patients.length === 0) fetchPatients();
     setEditingRecord(record);
     setFormData({
       patient_id: record.patient_id,
@@ -189,6 +191,7 @@ type MedicalRecord = {
   };
 
   const openAddModal = () => {
+    if (patients.length === 0) fetchPatients();
     setEditingRecord(null);
     setFormData({ patient_id: 0, date: '', doctor: '', diagnosis: '', treatment: '', observations: '', status: 'In Progress' });
     setShowModal(true);
@@ -255,7 +258,7 @@ type MedicalRecord = {
                     {records.map((record) => (
                       <tr key={record.id} className="hover:bg-gray-50 dark:hover:bg-gray-700">
                         <td className="px-6 py-4 whitespace-nowrap">
-                          <div className="text-sm font-medium text-gray-900 dark:text-white">{patients.find(p => p.id === record.patient_id)?.name || 'Unknown Patient'}</div>
+                          <div className="text-sm font-medium text-gray-900 dark:text-white">{record.patient?.name || patients.find(p => p.id === record.patient_id)?.name || 'Unknown Patient'}</div>
                         </td>
                         <td className="px-6 py-4 whitespace-nowrap">
                           <div className="text-sm text-gray-500 dark:text-gray-400">{record.date}</div>
@@ -0,0 +1,88 @@
+"""
+Archival job for the Hospital Management System.
+Moves completed medical records and appointments, and soft-deleted ones,
+older than a configurable age into the archive tables.
+
+Usage: python archive_records.py [--days 365] [--batch-size 500]
+"""
+
+import argparse
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, func, insert, literal, or_, select
+from sqlalchemy.types import DateTime
+
+from main import SessionLocal, MedicalRecord, Appointment, ArchivedMedicalRecord, ArchivedAppointment, SyncTombstone
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+
+# (live model, archive model, statuses after which a row can be archived,
+#  /sync resource type that gets a tombstone for each archived live row)
+ARCHIVE_TABLES = [
+    (MedicalRecord, ArchivedMedicalRecord, ("Completed",), None),
+    (Appointment, ArchivedAppointment, ("Completed", "Cancelled"), "appointment"),
+]
+
+def archive_table(db, model, archive_model, done_statuses, cutoff: datetime, batch_size: int,
+                  sync_resource_type: str = None) -> int:
+    """Move matching rows in batches so the write lock is only held briefly."""
+    cutoff_date = cutoff.strftime("%Y-%m-%d")
+    condition = or_(
+        and_(model.status.in_(done_statuses), model.date < cutoff_date),
+        model.deleted_at < cutoff,
+    )
+    # SQLite reuses the highest id once its row is gone, so that row stays behind
+    max_id = db.execute(select(func.max(model.id))).scalar()
+    if max_id is not None:
+        condition = and_(condition, model.id < max_id)
+    names = [column.name for column in model.__table__.columns]
+    moved = 0
+
+    while True:
+        ids = db.execute(select(model.id).where(condition).order_by(model.id).limit(batch_size)).scalars().all()
+        if not ids:
+            break
+        rows = select(
+            *[model.__table__.c[name] for name in names],
+            literal(datetime.utcnow(), DateTime()),
+        ).where(model.id.in_(ids))
+        db.execute(insert(archive_model).from_select(names + ["archived_at"], rows))
+        if sync_resource_type:
+            # Deleted rows already got their tombstone when they were deleted
+            db.execute(insert(SyncTombstone).from_select(
+                ["resource_type", "resource_id", "deleted_at"],
+                select(literal(sync_resource_type), model.id, literal(datetime.utcnow(), DateTime())).where(
+                    model.id.in_(ids), model.deleted_at.is_(None)
+                ),
+            ))
+        db.execute(delete(model).where(model.id.in_(ids)))
+        db.commit()
+        moved += len(ids)
+
+    return moved
+
+def archive_old_rows(older_than_days: int = ARCHIVE_AFTER_DAYS, batch_size: int = 500) -> dict:
+    """Archive every table in ARCHIVE_TABLES and return the rows moved per table."""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    db = SessionLocal()
+
+    try:
+        return {
+            model.__tablename__: archive_table(db, model, archive_model, statuses, cutoff, batch_size, resource_type)
+            for model, archive_model, statuses, resource_type in ARCHIVE_TABLES
+        }
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive old medical records and appointments")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="Minimum age in days")
+    parser.add_argument("--batch-size", type=int, default=500, help="Rows moved per transaction")
+    args = parser.parse_args()
+
+    for table, moved in archive_old_rows(args.days, args.batch_size).items():
+        print(f"Archived {moved} rows from {table}")
@@ -0,0 +1,99 @@
+"""
+Write-behind audit log for the Hospital Management System API.
+Request handlers push events into an in-memory ring buffer; a background
+thread persists them in batches so auditing adds no insert to the request path.
+"""
+
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import insert
+
+logger = logging.getLogger("audit")
+
+
+class AuditLog:
+    """Buffer audit events in memory and flush them to `model` in batches.
+
+    A flush happens every `flush_interval` seconds, or sooner once
+    `batch_size` events are waiting. When the buffer holds `capacity`
+    events the oldest ones are dropped and counted in `dropped`.
+    """
+
+    def __init__(self, session_factory, model, capacity: int = 100000, batch_size: int = 500,
+                 flush_interval: float = 2.0):
+        self.session_factory = session_factory
+        self.model = model
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._buffer = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def record(self, action: str, resource_type: str, resource_id=None, patient_id=None, actor=None):
+        event = {
+            "occurred_at": datetime.utcnow(),
+            "actor": actor,
+            "action": action,
+            "resource_type": resource_type,
+            "resource_id": resource_id,
+            "patient_id": patient_id,
+        }
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.dropped += 1
+            self._buffer.append(event)
+            pending = len(self._buffer)
+        if pending >= self.batch_size:
+            self._wake.set()
+
+    def flush(self) -> int:
+        """Persist everything buffered so far and return the number of events written."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                if not batch:
+                    return written
+                db = self.session_factory()
+                try:
+                    db.execute(insert(self.model), batch)
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                    with self._lock:
+                        # Put the batch back in front so it is retried on the next flush
+                        self._buffer.extendleft(reversed(batch))
+                    logger.exception("Failed to persist %d audit events", len(batch))
+                    return written
+                finally:
+                    db.close()
+                written += len(batch)
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="audit-flusher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and drain the buffer."""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
@@ -0,0 +1,104 @@
+"""
+Backfill migration for doctor references.
+Matches the free-text doctor names of existing medical records, appointments
+and prescriptions (archived and partitioned rows included) to users and
+stores the user id. Names are compared case-insensitively, ignoring
+punctuation and a leading "Dr"; names that match no user, or several, are
+listed so they can be fixed by hand. A bare surname ("Dr. Smith") is never
+linked automatically: when exactly one doctor has that surname it is listed
+as a possible match, and a confirmed mapping is applied with --link. Safe to
+run again: only rows without an id are looked at. The analytics rollups,
+which are keyed on the user id, are rebuilt afterwards.
+
+Usage: python backfill_doctors.py [--link "NAME=USER_ID" ...]
+"""
+
+import argparse
+
+from sqlalchemy import select, update
+
+from main import (
+    SessionLocal, MedicalRecord, Appointment, Prescription, ArchivedMedicalRecord, ArchivedAppointment,
+    attach_partitions, partition_table, partition_years, rebuild_rollups, staff_directory,
+)
+
+# (model, name column, user id column)
+DOCTOR_COLUMNS = [
+    (MedicalRecord, "doctor", "doctor_id"),
+    (ArchivedMedicalRecord, "doctor", "doctor_id"),
+    (Appointment, "doctor", "doctor_id"),
+    (ArchivedAppointment, "doctor", "doctor_id"),
+    (Prescription, "prescribed_by", "prescribed_by_id"),
+]
+PARTITIONED = (MedicalRecord, ArchivedMedicalRecord, Appointment, ArchivedAppointment)
+
+def backfill_table(db, table, name_column: str, id_column: str, year=None, links=None):
+    """Link every distinct unlinked name in the table; return (rows linked, unmatched names).
+
+    `links` maps names confirmed by hand to user ids and takes precedence over the directory.
+    """
+    if year is not None:
+        attach_partitions(db, [year])
+    name, user_id = table.c[name_column], table.c[id_column]
+    names = db.execute(select(name).where(user_id.is_(None), name.isnot(None)).distinct()).scalars().all()
+    linked, unmatched = 0, []
+
+    for value in names:
+        match = (links or {}).get(value) or staff_directory.resolve(value)
+        if match is None:
+            unmatched.append(value)
+            continue
+        result = db.execute(update(table).where(name == value, user_id.is_(None)).values({id_column: match}))
+        db.commit()
+        linked += result.rowcount
+        if year is not None:
+            # Committing releases the connection, so re-attach for the next statement
+            attach_partitions(db, [year])
+
+    return linked, unmatched
+
+def backfill_doctor_ids(links=None) -> dict:
+    """Backfill every table in DOCTOR_COLUMNS and its partitions; return results per table."""
+    staff_directory.refresh()
+    db = SessionLocal()
+    results = {}
+
+    try:
+        for model, name_column, id_column in DOCTOR_COLUMNS:
+            tables = [(model.__tablename__, model.__table__, None)]
+            if model in PARTITIONED:
+                tables += [
+                    (f"{model.__tablename__} ({year})", partition_table(model, year), year)
+                    for year in partition_years()
+                ]
+            for label, table, year in tables:
+                results[label] = backfill_table(db, table, name_column, id_column, year, links)
+        rebuild_rollups(db)
+        return results
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def parse_link(value: str):
+    name, _, user_id = value.rpartition("=")
+    if not name or not user_id.isdigit():
+        raise argparse.ArgumentTypeError(f"expected NAME=USER_ID, got {value!r}")
+    return name, int(user_id)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Link free-text doctor names to user ids")
+    parser.add_argument("--link", type=parse_link, action="append", default=[], metavar="NAME=USER_ID",
+                        help="Link a name to a user after checking it by hand (repeatable)")
+    args = parser.parse_args()
+
+    for table, (linked, unmatched) in backfill_doctor_ids(dict(args.link)).items():
+        print(f"{table}: linked {linked} rows")
+        for name in unmatched:
+            suggestion = staff_directory.suggest(name)
+            if suggestion is not None:
+                print(f"  possible match for {name!r}: {staff_directory.name(suggestion)!r} "
+                      f"(confirm with --link \"{name}={suggestion}\")")
+            else:
+                print(f"  no unique user matches {name!r}")
@@ -0,0 +1,300 @@
+"""
+Online backup and restore for the Hospital Management System database.
+Snapshots are taken with SQLite's backup API a few pages at a time, pausing
+between steps, while the server keeps running. The database runs in WAL mode
+(see main.py), so the copy reads from one pinned snapshot and writers are
+never blocked by it.
+
+A snapshot is one tar file holding the main database, its year partitions
+(active and detached, see partitions.py) and the audit log database, each
+copied the same way. It is gzip-compressed by default and gets a .sha256 file
+next to it that verify and restore check before use.
+
+Usage: python backup.py create [--database hospital_management.db] [--audit-database audit_log.db]
+                               [--partitions-dir partitions] [--output-dir backups] [--no-compress]
+                               [--pages-per-step 1024] [--step-sleep 0.01]
+       python backup.py verify SNAPSHOT
+       python backup.py restore SNAPSHOT [--database hospital_management.db] [--audit-database audit_log.db]
+                                         [--partitions-dir partitions]
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import sqlite3
+import tarfile
+import tempfile
+import time
+from datetime import datetime
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "./backups")
+DATABASE_PATH = "./hospital_management.db"
+# Same settings as main.py
+AUDIT_DATABASE_PATH = os.getenv("AUDIT_DATABASE_URL", "sqlite:///./audit_log.db").replace("sqlite:///", "", 1)
+PARTITIONS_DIR = os.getenv("PARTITIONS_DIR", "./partitions")
+CHUNK_SIZE = 1024 * 1024
+
+# Names of the files inside a snapshot
+MAIN_MEMBER = "hospital_management.db"
+AUDIT_MEMBER = "audit_log.db"
+PARTITION_MEMBERS = ("partitions", "partitions/detached")
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def checksum_path(snapshot_path: str) -> str:
+    return snapshot_path + ".sha256"
+
+
+def database_files(database_path: str, audit_path: str, partitions_dir: str) -> list:
+    """(snapshot member name, path) of every database file to back up, main database first.
+
+    The main database is copied before the partitions: a year moved into a
+    partition during the backup then shows up twice in the snapshot rather
+    than not at all, and running partitions.py create again removes the copy.
+    """
+    files = [(MAIN_MEMBER, database_path)]
+    for member_dir in PARTITION_MEMBERS:
+        directory = os.path.join(partitions_dir, os.path.relpath(member_dir, "partitions"))
+        if os.path.isdir(directory):
+            files += [
+                (f"{member_dir}/{name}", os.path.join(directory, name))
+                for name in sorted(os.listdir(directory)) if name.endswith(".db") and name[:-3].isdigit()
+            ]
+    if os.path.exists(audit_path):
+        files.append((AUDIT_MEMBER, audit_path))
+    return files
+
+
+def _copy_online(source_path: str, target_path: str, pages_per_step: int, step_sleep: float,
+                 on_step=None) -> int:
+    """Copy a live database page by page; return the number of pages copied.
+
+    on_step(pages copied, total pages) is called after every step.
+    """
+    steps = {"pages": 0}
+
+    def progress(status, remaining, total):
+        steps["pages"] = total
+        if on_step:
+            on_step(total - remaining, total)
+        # Throttle the copy so the server keeps most of the disk bandwidth
+        if remaining and step_sleep:
+            time.sleep(step_sleep)
+
+    source = sqlite3.connect(source_path, isolation_level=None)
+    target = sqlite3.connect(target_path)
+    try:
+        # A write by another connection restarts an incremental backup at its next step,
+        # so under steady writes it would never finish. In WAL mode a read transaction
+        # held across all steps copies one consistent snapshot without blocking writers.
+        pinned = source.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        if pinned:
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        source.backup(target, pages=pages_per_step, progress=progress)
+        if pinned:
+            source.execute("COMMIT")
+        # The copy inherits WAL mode; switch it back so the snapshot is one self-contained file
+        target.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        target.close()
+        source.close()
+    return steps["pages"]
+
+
+def _integrity_check(path: str):
+    connection = sqlite3.connect(path)
+    try:
+        result = connection.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        connection.close()
+    if result != "ok":
+        raise ValueError(f"Integrity check failed for {path}: {result}")
+
+
+def create_backup(database_path: str = DATABASE_PATH, output_dir: str = BACKUP_DIR, compress: bool = True,
+                  pages_per_step: int = 1024, step_sleep: float = 0.01, audit_path: str = AUDIT_DATABASE_PATH,
+                  partitions_dir: str = PARTITIONS_DIR, progress=None) -> dict:
+    """Snapshot the live databases into output_dir and return the snapshot path, size, checksum and timings.
+
+    progress(bytes copied, total bytes, message) is called as the copy goes; an
+    exception raised from it stops the backup.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    name = f"hospital_management-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.tar"
+    snapshot_path = os.path.join(output_dir, name + (".gz" if compress else ""))
+    copy_dir = os.path.join(output_dir, name + ".partial.d")
+
+    started = time.monotonic()
+    try:
+        files = database_files(database_path, audit_path, partitions_dir)
+        total_bytes = sum(os.path.getsize(path) for _, path in files)
+        pages, database_bytes = 0, 0
+        for member, path in files:
+            copy_path = os.path.join(copy_dir, member)
+            os.makedirs(os.path.dirname(copy_path), exist_ok=True)
+            size, done = os.path.getsize(path), database_bytes
+
+            def on_step(copied, total):
+                if progress:
+                    progress(done + size * copied // max(total, 1), total_bytes, f"Copying {member}")
+            pages += _copy_online(path, copy_path, pages_per_step, step_sleep, on_step)
+            database_bytes += os.path.getsize(copy_path)
+        copied = time.monotonic()
+        mode, options = ("w:gz", {"compresslevel": 6}) if compress else ("w", {})
+        with tarfile.open(snapshot_path + ".partial", mode, **options) as bundle:
+            for member, _ in files:
+                bundle.add(os.path.join(copy_dir, member), arcname=member)
+        os.replace(snapshot_path + ".partial", snapshot_path)
+    finally:
+        shutil.rmtree(copy_dir, ignore_errors=True)
+        if os.path.exists(snapshot_path + ".partial"):
+            os.remove(snapshot_path + ".partial")
+
+    checksum = file_sha256(snapshot_path)
+    with open(checksum_path(snapshot_path), "w") as output:
+        output.write(f"{checksum}  {os.path.basename(snapshot_path)}\n")
+    finished = time.monotonic()
+
+    copy_seconds = copied - started
+    return {
+        "path": os.path.abspath(snapshot_path),
+        "sha256": checksum,
+        "files": [member for member, _ in files],
+        "pages": pages,
+        "database_bytes": database_bytes,
+        "snapshot_bytes": os.path.getsize(snapshot_path),
+        "copy_seconds": round(copy_seconds, 3),
+        "total_seconds": round(finished - started, 3),
+        "copy_mb_per_second": round(database_bytes / 1e6 / copy_seconds, 1) if copy_seconds else None,
+    }
+
+
+def verify_backup(snapshot_path: str):
+    """Check a snapshot against its .sha256 file; raise ValueError if it does not match."""
+    if not os.path.exists(checksum_path(snapshot_path)):
+        raise ValueError(f"No checksum file for {snapshot_path}")
+    with open(checksum_path(snapshot_path)) as source:
+        expected = source.read().split()[0]
+    if file_sha256(snapshot_path) != expected:
+        raise ValueError(f"Checksum mismatch for {snapshot_path}")
+
+
+def _restore_target(member: str, database_path: str, audit_path: str, partitions_dir: str) -> str:
+    """Where a snapshot member goes; ValueError for anything a snapshot should not contain."""
+    if member == MAIN_MEMBER:
+        return database_path
+    if member == AUDIT_MEMBER:
+        return audit_path
+    member_dir, _, name = member.rpartition("/")
+    if member_dir in PARTITION_MEMBERS and name.endswith(".db") and name[:-3].isdigit():
+        return os.path.join(partitions_dir, os.path.relpath(member_dir, "partitions"), name)
+    raise ValueError(f"Unexpected file in snapshot: {member}")
+
+
+def restore_backup(snapshot_path: str, database_path: str = DATABASE_PATH, audit_path: str = AUDIT_DATABASE_PATH,
+                   partitions_dir: str = PARTITIONS_DIR) -> dict:
+    """Verify a snapshot and copy every database in it back; return the bytes restored and timings.
+
+    Each file goes through SQLite's backup API in a single step, so open
+    connections see either the old or the restored database, never a mix.
+    Partition files that are not in the snapshot are renamed to
+    <year>.db.replaced, since their rows are back in the main database.
+    """
+    started = time.monotonic()
+    verify_backup(snapshot_path)
+
+    directory = os.path.dirname(os.path.abspath(database_path))
+    restore_dir = tempfile.mkdtemp(dir=directory)
+    try:
+        with tarfile.open(snapshot_path) as bundle:
+            members = bundle.getmembers()
+            targets = {}
+            for member in members:
+                if not member.isfile():
+                    raise ValueError(f"Unexpected entry in snapshot: {member.name}")
+                targets[member.name] = _restore_target(member.name, database_path, audit_path, partitions_dir)
+            if MAIN_MEMBER not in targets:
+                raise ValueError(f"{snapshot_path} has no {MAIN_MEMBER}")
+            for member in members:
+                restore_path = os.path.join(restore_dir, member.name)
+                os.makedirs(os.path.dirname(restore_path), exist_ok=True)
+                with bundle.extractfile(member) as source, open(restore_path, "wb") as target:
+                    shutil.copyfileobj(source, target, CHUNK_SIZE)
+        # Nothing is overwritten until every file has passed
+        for member in targets:
+            _integrity_check(os.path.join(restore_dir, member))
+
+        restored_bytes = 0
+        for member, target_path in targets.items():
+            os.makedirs(os.path.dirname(os.path.abspath(target_path)), exist_ok=True)
+            source = sqlite3.connect(os.path.join(restore_dir, member))
+            target = sqlite3.connect(target_path)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+            restored_bytes += os.path.getsize(os.path.join(restore_dir, member))
+
+        restored = {os.path.abspath(path) for path in targets.values()}
+        for member, path in database_files(database_path, audit_path, partitions_dir):
+            if member.startswith("partitions/") and os.path.abspath(path) not in restored:
+                os.replace(path, path + ".replaced")
+    finally:
+        shutil.rmtree(restore_dir, ignore_errors=True)
+
+    seconds = time.monotonic() - started
+    return {
+        "files": list(targets),
+        "database_bytes": restored_bytes,
+        "seconds": round(seconds, 3),
+        "mb_per_second": round(restored_bytes / 1e6 / seconds, 1) if seconds else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Back up and restore the hospital database while it is in use")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="Take an online snapshot")
+    create.add_argument("--database", default=DATABASE_PATH)
+    create.add_argument("--output-dir", default=BACKUP_DIR)
+    create.add_argument("--audit-database", default=AUDIT_DATABASE_PATH)
+    create.add_argument("--partitions-dir", default=PARTITIONS_DIR)
+    create.add_argument("--no-compress", action="store_true", help="Write a plain .tar file instead of .tar.gz")
+    create.add_argument("--pages-per-step", type=int, default=1024, help="Pages copied per backup step")
+    create.add_argument("--step-sleep", type=float, default=0.01, help="Seconds to pause between steps")
+    verify = commands.add_parser("verify", help="Check a snapshot against its checksum")
+    verify.add_argument("snapshot")
+    restore = commands.add_parser("restore", help="Replace the database with a snapshot")
+    restore.add_argument("snapshot")
+    restore.add_argument("--database", default=DATABASE_PATH)
+    restore.add_argument("--audit-database", default=AUDIT_DATABASE_PATH)
+    restore.add_argument("--partitions-dir", default=PARTITIONS_DIR)
+    args = parser.parse_args()
+
+    try:
+        if args.command == "create":
+            result = create_backup(args.database, args.output_dir, not args.no_compress, args.pages_per_step,
+                                   args.step_sleep, args.audit_database, args.partitions_dir)
+            print(f"Snapshot {result['path']} ({result['snapshot_bytes']} bytes, sha256 {result['sha256']})")
+            print(f"Files: {', '.join(result['files'])}")
+            print(f"Copied {result['database_bytes']} bytes in {result['copy_seconds']}s "
+                  f"({result['copy_mb_per_second']} MB/s), {result['total_seconds']}s in total")
+        elif args.command == "verify":
+            verify_backup(args.snapshot)
+            print(f"{args.snapshot}: checksum OK")
+        else:
+            result = restore_backup(args.snapshot, args.database, args.audit_database, args.partitions_dir)
+            print(f"Restored {', '.join(result['files'])} ({result['database_bytes']} bytes) in {result['seconds']}s "
+                  f"({result['mb_per_second']} MB/s)")
+    except (ValueError, tarfile.TarError) as exc:
+        parser.exit(1, f"{exc}\n")
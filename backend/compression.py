@@ -0,0 +1,212 @@
+"""
+Response compression middleware for the Hospital Management System API.
+Compresses large responses with brotli or gzip, including streamed responses.
+"""
+
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+DEFAULT_COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/xml",
+    "application/javascript",
+    "text/",
+)
+
+
+def parse_accept_encoding(header_value: str) -> dict:
+    """Return a mapping of accepted encodings to their q-values."""
+    encodings = {}
+    for part in header_value.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        encodings[token] = quality
+    return encodings
+
+
+class _GzipEncoder:
+    name = "gzip"
+
+    def __init__(self, level: int):
+        # wbits=31 writes a gzip container instead of raw zlib
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliEncoder:
+    name = "br"
+
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class CompressionMiddleware:
+    """Compress responses above `minimum_size` whose content type is allowed.
+
+    Responses sent in a single body message are compressed in one go and keep
+    an accurate Content-Length. Streamed responses are buffered until they
+    reach `minimum_size`, then compressed and flushed every `minimum_size`
+    bytes so that clients keep receiving data while the stream is still open.
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        content_types=DEFAULT_COMPRESSIBLE_TYPES,
+        enable_brotli: bool = True,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.content_types = tuple(content_types)
+        self.enable_brotli = enable_brotli and brotli is not None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = self.choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+    def choose_encoding(self, accept_encoding: str):
+        accepted = parse_accept_encoding(accept_encoding)
+        if self.enable_brotli and accepted.get("br", 0) > 0:
+            return "br"
+        if accepted.get("gzip", accepted.get("*", 0)) > 0:
+            return "gzip"
+        return None
+
+    def is_compressible(self, content_type: str) -> bool:
+        content_type = content_type.lower()
+        return any(content_type.startswith(allowed) for allowed in self.content_types)
+
+    def make_encoder(self, encoding: str):
+        if encoding == "br":
+            return _BrotliEncoder(self.brotli_quality)
+        return _GzipEncoder(self.gzip_level)
+
+
+class _CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.downstream_send = send
+        self.start_message = None
+        self.buffer = b""
+        self.encoder = None
+        self.passthrough = False
+
+    async def send(self, message):
+        message_type = message["type"]
+
+        if message_type == "http.response.start":
+            self.start_message = message
+            headers = Headers(raw=message["headers"])
+            if "content-encoding" in headers or not self.middleware.is_compressible(
+                headers.get("content-type", "")
+            ):
+                self.passthrough = True
+                await self.downstream_send(message)
+            return
+
+        if message_type != "http.response.body" or self.passthrough:
+            await self.downstream_send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.encoder is not None:
+            await self._send_compressed(body, more_body)
+            return
+
+        self.buffer += body
+        if len(self.buffer) < self.middleware.minimum_size:
+            if more_body:
+                return
+            # Small response: send it untouched
+            await self.downstream_send(self.start_message)
+            await self.downstream_send(
+                {"type": "http.response.body", "body": self.buffer, "more_body": False}
+            )
+            return
+
+        # Large enough to be worth compressing
+        self.encoder = self.middleware.make_encoder(self.encoding)
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        headers["Content-Encoding"] = self.encoder.name
+        headers.add_vary_header("Accept-Encoding")
+
+        if not more_body:
+            compressed = self.encoder.compress(self.buffer) + self.encoder.finish()
+            headers["Content-Length"] = str(len(compressed))
+            await self.downstream_send(self.start_message)
+            await self.downstream_send(
+                {"type": "http.response.body", "body": compressed, "more_body": False}
+            )
+            return
+
+        # Streaming response: the final length is unknown
+        if "content-length" in headers:
+            del headers["Content-Length"]
+        await self.downstream_send(self.start_message)
+        await self._send_compressed(b"", more_body=True)
+
+    async def _send_compressed(self, body: bytes, more_body: bool):
+        # Every flush costs a few bytes of padding, so small stream chunks
+        # (e.g. NDJSON lines) are collected until minimum_size before flushing
+        self.buffer += body
+        if more_body:
+            if len(self.buffer) < self.middleware.minimum_size:
+                return
+            chunk = self.encoder.compress(self.buffer) + self.encoder.flush()
+        else:
+            chunk = self.encoder.compress(self.buffer) + self.encoder.finish()
+        self.buffer = b""
+        await self.downstream_send(
+            {"type": "http.response.body", "body": chunk, "more_body": more_body}
+        )
@@ -0,0 +1,209 @@
+"""
+Idempotency-Key support for write endpoints of the Hospital Management System API.
+Stores the first response for a key so client retries replay it instead of writing again.
+"""
+
+import hashlib
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, Response
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+IDEMPOTENT_METHODS = {"POST", "PUT"}
+
+
+class IdempotencyMiddleware:
+    """Deduplicate POST/PUT requests carrying an `Idempotency-Key` header.
+
+    The first request with a key reserves a row, runs normally and stores its
+    status and body. Retries with the same key and payload get the stored
+    response back; a retry that arrives while the first is still running gets
+    409, and reusing a key with a different payload gets 422. Server errors are
+    not stored so that the client can retry them. Rows expire after `ttl`.
+
+    A reservation whose request never finished (the process died) is taken
+    over by the next retry once it is older than `lease`. Paths in
+    `excluded_paths` (e.g. the login route, whose responses are credentials)
+    are never stored.
+    """
+
+    def __init__(self, app, session_factory, model, key_func, ttl: timedelta = timedelta(hours=24),
+                 lease: timedelta = timedelta(seconds=60), excluded_paths=(), cleanup_interval: float = 300.0):
+        self.app = app
+        self.session_factory = session_factory
+        self.model = model
+        self.key_func = key_func
+        self.ttl = ttl
+        self.lease = lease
+        self.excluded_paths = set(excluded_paths)
+        self.cleanup_interval = cleanup_interval
+        self._last_cleanup = 0.0
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["method"] not in IDEMPOTENT_METHODS
+                or scope["path"] in self.excluded_paths):
+            await self.app(scope, receive, send)
+            return
+
+        idempotency_key = Headers(scope=scope).get(IDEMPOTENCY_HEADER)
+        if not idempotency_key:
+            await self.app(scope, receive, send)
+            return
+
+        body = await _read_body(receive)
+        storage_key = hashlib.sha256(
+            "\0".join(
+                [self.key_func(scope), scope["method"], scope["path"], idempotency_key]
+            ).encode()
+        ).hexdigest()
+        request_hash = hashlib.sha256(body).hexdigest()
+
+        existing = await run_in_threadpool(self._reserve, storage_key, request_hash)
+        if existing is not None:
+            await self._respond_existing(existing, request_hash, scope, receive, send)
+            return
+
+        captured = {"status": 500, "content_type": None, "body": b""}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                captured["status"] = message["status"]
+                captured["content_type"] = Headers(raw=message["headers"]).get("content-type")
+            elif message["type"] == "http.response.body":
+                captured["body"] += message.get("body", b"")
+            await send(message)
+
+        try:
+            await self.app(scope, _replay_body(body, receive), capture_send)
+        finally:
+            if captured["status"] >= 500:
+                await run_in_threadpool(self._release, storage_key)
+            else:
+                await run_in_threadpool(self._complete, storage_key, captured)
+
+        if time.monotonic() - self._last_cleanup > self.cleanup_interval:
+            self._last_cleanup = time.monotonic()
+            await run_in_threadpool(self.purge_expired)
+
+    async def _respond_existing(self, existing, request_hash, scope, receive, send):
+        if existing["request_hash"] != request_hash:
+            response = JSONResponse(
+                {"detail": "Idempotency-Key was already used with a different request body"},
+                status_code=422,
+            )
+        elif existing["status_code"] is None:
+            response = JSONResponse(
+                {"detail": "A request with this Idempotency-Key is still being processed"},
+                status_code=409,
+                headers={"Retry-After": "1"},
+            )
+        else:
+            response = Response(
+                content=existing["response_body"],
+                status_code=existing["status_code"],
+                media_type=existing["content_type"],
+                headers={"Idempotent-Replayed": "true"},
+            )
+        await response(scope, receive, send)
+
+    def _reserve(self, storage_key: str, request_hash: str):
+        """Insert a placeholder row, or return the stored row if the key is taken."""
+        db = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            row = db.get(self.model, storage_key)
+            if row is not None and row.expires_at <= now:
+                db.delete(row)
+                db.commit()
+                row = None
+            if row is not None and row.status_code is None and (
+                row.reserved_at is None or row.reserved_at <= now - self.lease
+            ):
+                # Abandoned reservation: take it over, unless a concurrent retry just did
+                stale = self.model.reserved_at.is_(None) if row.reserved_at is None else (
+                    self.model.reserved_at == row.reserved_at
+                )
+                taken = db.query(self.model).filter(
+                    self.model.key == storage_key, self.model.status_code.is_(None), stale
+                ).update({"request_hash": request_hash, "reserved_at": now, "expires_at": now + self.ttl})
+                db.commit()
+                if taken:
+                    return None
+                return {"request_hash": request_hash, "status_code": None}
+            if row is not None:
+                return {
+                    "request_hash": row.request_hash,
+                    "status_code": row.status_code,
+                    "content_type": row.content_type,
+                    "response_body": row.response_body,
+                }
+            db.add(self.model(key=storage_key, request_hash=request_hash, reserved_at=now,
+                              expires_at=now + self.ttl))
+            try:
+                db.commit()
+            except IntegrityError:
+                # Lost the race against a concurrent retry with the same key
+                db.rollback()
+                return {"request_hash": request_hash, "status_code": None}
+            return None
+        finally:
+            db.close()
+
+    def _complete(self, storage_key: str, captured: dict):
+        db = self.session_factory()
+        try:
+            row = db.get(self.model, storage_key)
+            if row is not None:
+                row.status_code = captured["status"]
+                row.content_type = captured["content_type"]
+                row.response_body = captured["body"]
+                db.commit()
+        finally:
+            db.close()
+
+    def _release(self, storage_key: str):
+        db = self.session_factory()
+        try:
+            db.query(self.model).filter(self.model.key == storage_key).delete()
+            db.commit()
+        finally:
+            db.close()
+
+    def purge_expired(self) -> int:
+        db = self.session_factory()
+        try:
+            deleted = db.query(self.model).filter(self.model.expires_at <= datetime.utcnow()).delete()
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+
+async def _read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        body += message.get("body", b"")
+        if not message.get("more_body", False):
+            break
+    return body
+
+
+def _replay_body(body: bytes, receive):
+    sent = False
+
+    async def replay():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # Body already consumed: wait for the real disconnect
+        return await receive()
+
+    return replay
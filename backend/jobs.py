@@ -0,0 +1,241 @@
+"""
+Background jobs for the Hospital Management System API.
+Runs exports, imports and reports in a pool of worker processes so that
+long operations never block a request handler.
+
+Job rows live in the `jobs` table (see the Job model in main.py). Workers
+talk to the database through their own engine and only use plain SQL so
+that they do not need to import the FastAPI application.
+"""
+
+import csv
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import create_engine, text
+
+from backup import create_backup
+
+EXPORTABLE_TABLES = ("patients", "medical_records", "appointments", "prescriptions")
+REQUIRED_PATIENT_FIELDS = ("name", "phone", "date_of_birth", "gender", "blood_type")
+IMPORTABLE_PATIENT_FIELDS = REQUIRED_PATIENT_FIELDS + ("address", "emergency_contact")
+BATCH_SIZE = 500
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _now() -> str:
+    # Same text format SQLAlchemy uses for DateTime columns on SQLite
+    return datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+class JobContext:
+    """Handle passed to job functions for progress reporting and cancellation."""
+
+    def __init__(self, engine, job_id: int, results_dir: str):
+        self.engine = engine
+        self.job_id = job_id
+        self.results_dir = results_dir
+
+    def report(self, done: int, total: int, message: str = None):
+        """Store progress and raise JobCancelled if a cancel was requested."""
+        progress = min(done / total, 1.0) if total else 1.0
+        with self.engine.begin() as conn:
+            conn.execute(
+                text("UPDATE jobs SET progress = :progress, message = :message WHERE id = :id"),
+                {"progress": progress, "message": message, "id": self.job_id},
+            )
+            cancel_requested = conn.execute(
+                text("SELECT cancel_requested FROM jobs WHERE id = :id"), {"id": self.job_id}
+            ).scalar()
+        if cancel_requested:
+            raise JobCancelled()
+
+    def result_path(self, extension: str) -> str:
+        os.makedirs(self.results_dir, exist_ok=True)
+        return os.path.join(self.results_dir, f"job_{self.job_id}.{extension}")
+
+
+# Job functions: each takes (context, params) and returns the result file path
+
+def export_table(ctx: JobContext, params: dict) -> str:
+    """Export the live rows of one table to CSV, in id order."""
+    table = params.get("table")
+    if table not in EXPORTABLE_TABLES:
+        raise ValueError(f"table must be one of: {', '.join(EXPORTABLE_TABLES)}")
+
+    with ctx.engine.connect() as conn:
+        total = conn.execute(text(f"SELECT COUNT(*) FROM {table} WHERE deleted_at IS NULL")).scalar()
+
+    path = ctx.result_path("csv")
+    done, last_id = 0, 0
+    with open(path, "w", newline="") as output:
+        writer = csv.writer(output)
+        header_written = False
+        while True:
+            # Keyset pagination keeps each read short so progress updates can commit
+            with ctx.engine.connect() as conn:
+                result = conn.execute(
+                    text(f"SELECT * FROM {table} WHERE deleted_at IS NULL AND id > :last_id ORDER BY id LIMIT :limit"),
+                    {"last_id": last_id, "limit": BATCH_SIZE},
+                )
+                columns = list(result.keys())
+                rows = result.fetchall()
+            if not header_written:
+                writer.writerow(columns)
+                header_written = True
+            if not rows:
+                break
+            writer.writerows(rows)
+            last_id = rows[-1][columns.index("id")]
+            done += len(rows)
+            ctx.report(done, total, f"Exported {done} of {total} rows")
+    return path
+
+
+def import_patients(ctx: JobContext, params: dict) -> str:
+    """Insert patients from params["patients"] in batches and write a JSON summary.
+
+    Rows missing a required field are skipped and listed by index in the summary.
+    """
+    patients = params.get("patients") or []
+    total = len(patients)
+    imported = 0
+    skipped = []
+
+    for start in range(0, total, BATCH_SIZE):
+        batch = []
+        for index, patient in enumerate(patients[start:start + BATCH_SIZE], start=start):
+            if not isinstance(patient, dict) or any(not patient.get(field) for field in REQUIRED_PATIENT_FIELDS):
+                skipped.append(index)
+                continue
+            row = {field: patient.get(field) for field in IMPORTABLE_PATIENT_FIELDS}
+            row["created_at"] = row["updated_at"] = _now()
+            batch.append(row)
+        if not batch:
+            continue
+        with ctx.engine.begin() as conn:
+            conn.execute(
+                text(
+                    "INSERT INTO patients (name, phone, date_of_birth, gender, blood_type, address, "
+                    "emergency_contact, created_at, updated_at) VALUES (:name, :phone, :date_of_birth, "
+                    ":gender, :blood_type, :address, :emergency_contact, :created_at, :updated_at)"
+                ),
+                batch,
+            )
+        imported += len(batch)
+        ctx.report(imported + len(skipped), total, f"Imported {imported} of {total} patients")
+
+    path = ctx.result_path("json")
+    with open(path, "w") as output:
+        json.dump({"imported": imported, "skipped": skipped}, output)
+    return path
+
+
+def summary_report(ctx: JobContext, params: dict) -> str:
+    """Write headline counts for patients, appointments and prescriptions as JSON."""
+    queries = {
+        "patients": "SELECT 'total', COUNT(*) FROM patients WHERE deleted_at IS NULL",
+        "appointments_by_status": "SELECT status, COUNT(*) FROM appointments WHERE deleted_at IS NULL GROUP BY status",
+        "prescriptions_by_status": "SELECT status, COUNT(*) FROM prescriptions WHERE deleted_at IS NULL GROUP BY status",
+        "records_by_status": "SELECT status, COUNT(*) FROM medical_records WHERE deleted_at IS NULL GROUP BY status",
+    }
+    report = {}
+    for step, (name, query) in enumerate(queries.items(), start=1):
+        with ctx.engine.connect() as conn:
+            report[name] = {key: count for key, count in conn.execute(text(query))}
+        ctx.report(step, len(queries), f"Computed {name}")
+
+    path = ctx.result_path("json")
+    with open(path, "w") as output:
+        json.dump(report, output, indent=2)
+    return path
+
+
+def backup_database(ctx: JobContext, params: dict) -> str:
+    """Take an online snapshot of the database with backup.create_backup and return its path."""
+    ctx.report(0, 1, "Copying database")
+    # Progress is written to the database being copied; the copy reads a pinned
+    # snapshot in WAL mode (see backup.py), so these writes do not restart it
+    result = create_backup(ctx.engine.url.database, compress=params.get("compress", True), progress=ctx.report)
+    ctx.report(1, 1, (
+        f"Copied {result['database_bytes']} bytes in {result['copy_seconds']}s "
+        f"({result['copy_mb_per_second']} MB/s); snapshot {result['snapshot_bytes']} bytes, sha256 {result['sha256']}"
+    ))
+    return result["path"]
+
+
+JOB_FUNCTIONS = {
+    "export": export_table,
+    "import_patients": import_patients,
+    "summary_report": summary_report,
+    "backup": backup_database,
+}
+
+
+def run_job(database_url: str, job_id: int, kind: str, params: dict, results_dir: str):
+    """Entry point executed in a worker process."""
+    engine = create_engine(database_url, connect_args={"timeout": 30})
+    try:
+        with engine.begin() as conn:
+            job = conn.execute(
+                text("SELECT status, cancel_requested FROM jobs WHERE id = :id"), {"id": job_id}
+            ).first()
+            if job is None or job.status != "queued":
+                return
+            if job.cancel_requested:
+                conn.execute(
+                    text("UPDATE jobs SET status = 'cancelled', finished_at = :now WHERE id = :id"),
+                    {"now": _now(), "id": job_id},
+                )
+                return
+            conn.execute(
+                text("UPDATE jobs SET status = 'running', started_at = :now WHERE id = :id"),
+                {"now": _now(), "id": job_id},
+            )
+
+        try:
+            result_path = JOB_FUNCTIONS[kind](JobContext(engine, job_id, results_dir), params)
+        except JobCancelled:
+            update = ("UPDATE jobs SET status = 'cancelled', finished_at = :now WHERE id = :id", {})
+        except Exception as exc:
+            update = ("UPDATE jobs SET status = 'failed', error = :error, finished_at = :now WHERE id = :id",
+                      {"error": str(exc)})
+        else:
+            update = ("UPDATE jobs SET status = 'completed', progress = 1, result_path = :result_path, "
+                      "finished_at = :now WHERE id = :id", {"result_path": os.path.abspath(result_path)})
+
+        statement, values = update
+        with engine.begin() as conn:
+            conn.execute(text(statement), {"now": _now(), "id": job_id, **values})
+    finally:
+        engine.dispose()
+
+
+class JobQueue:
+    """Dispatches queued jobs to a pool of worker processes."""
+
+    def __init__(self, database_url: str, results_dir: str, max_workers: int = 2):
+        self.database_url = database_url
+        self.results_dir = os.path.abspath(results_dir)
+        self.max_workers = max_workers
+        self.executor = None
+
+    def start(self):
+        # spawn avoids forking a process that already runs server threads
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def submit(self, job_id: int, kind: str, params: dict):
+        self.executor.submit(run_job, self.database_url, job_id, kind, params, self.results_dir)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -1,31 +1,49 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, ForeignKey
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse
+from sqlalchemy import create_engine, Column, Index, Integer, String, DateTime, Boolean, ForeignKey, LargeBinary, Float
+from sqlalchemy import MetaData, Table
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
+from sqlalchemy.orm import sessionmaker, Session, relationship, contains_eager, noload
+from sqlalchemy import and_, case, func, insert, inspect, or_, select, text, union_all
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from collections import Counter
 from datetime import datetime
 from typing import List, Optional
 import uvicorn
 import os
+import json
+import base64
+
+from audit import AuditLog
+from compression import CompressionMiddleware
+from idempotency import IdempotencyMiddleware
+from jobs import JOB_FUNCTIONS, JobQueue
+from rate_limit import RateLimiter, RateLimitMiddleware, make_client_key
+from replica import ReadYourWritesTracker
+from staff_directory import StaffDirectory
 
 # Create FastAPI app
 app = FastAPI(title="Hospital Management System API", version="1.0.0")
 
-# Add CORS middleware to allow requests from frontend
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, specify your frontend URL
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
 # Database setup
 SQLALCHEMY_DATABASE_URL = "sqlite:///./hospital_management.db"
 engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Optional read replica: GET routes read from it unless the same client wrote
+# within the last READ_YOUR_WRITES_SECONDS, in which case they use the primary
+READ_REPLICA_DATABASE_URL = os.getenv("READ_REPLICA_DATABASE_URL")
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+if READ_REPLICA_DATABASE_URL:
+    replica_engine = create_engine(READ_REPLICA_DATABASE_URL, connect_args={"check_same_thread": False})
+    ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+else:
+    ReplicaSessionLocal = SessionLocal
+recent_writers = ReadYourWritesTracker(READ_YOUR_WRITES_SECONDS)
+
 # Database Models
 class User(Base):
     __tablename__ = "users"
@@ -42,7 +60,7 @@ class User(Base):
     
     # Relationships
     patients = relationship("Patient", back_populates="owner")
-    appointments = relationship("Appointment", back_populates="created_by_user")
+    appointments = relationship("Appointment", back_populates="created_by_user", foreign_keys="Appointment.owner_id")
 
 class Patient(Base):
     __tablename__ = "patients"
@@ -56,7 +74,8 @@ class Patient(Base):
     address = Column(String, nullable=True)
     emergency_contact = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # Read by /sync
+    deleted_at = Column(DateTime, nullable=True, index=True)  # Set instead of deleting the row
     
     # Foreign Key
     owner_id = Column(Integer, ForeignKey("users.id"))
@@ -72,14 +91,16 @@ class MedicalRecord(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     patient_id = Column(Integer, ForeignKey("patients.id"))
-    date = Column(String)  # Format: YYYY-MM-DD
-    doctor = Column(String)
+    date = Column(String, index=True)  # Format: YYYY-MM-DD
+    doctor = Column(String)  # Name at the time of writing; responses show the current name of doctor_id
+    doctor_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
     diagnosis = Column(String)
     treatment = Column(String)
     observations = Column(String, nullable=True)
     status = Column(String, default="In Progress")  # In Progress, Completed, Pending
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    deleted_at = Column(DateTime, nullable=True, index=True)  # Set instead of deleting the row
     
     # Relationship
     patient = relationship("Patient", back_populates="medical_records")
@@ -89,18 +110,20 @@ class Appointment(Base):
     
     id = Column(Integer, primary_key=True, index=True)
     patient_id = Column(Integer, ForeignKey("patients.id"))
-    date = Column(String)  # Format: YYYY-MM-DD
+    date = Column(String, index=True)  # Format: YYYY-MM-DD
     time = Column(String)  # Format: HH:MM
-    doctor = Column(String)
+    doctor = Column(String)  # Name at the time of writing; responses show the current name of doctor_id
+    doctor_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
     reason = Column(String)
     status = Column(String, default="Scheduled")  # Scheduled, Completed, Cancelled
     created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # Read by /sync
+    deleted_at = Column(DateTime, nullable=True, index=True)  # Set instead of deleting the row
     
     # Foreign Keys
     owner_id = Column(Integer, ForeignKey("users.id"))
     patient = relationship("Patient", back_populates="appointments")
-    created_by_user = relationship("User", back_populates="appointments")
+    created_by_user = relationship("User", back_populates="appointments", foreign_keys=[owner_id])
 
 class Prescription(Base):
     __tablename__ = "prescriptions"
@@ -112,29 +135,339 @@ class Prescription(Base):
     dosage = Column(String)
     frequency = Column(String)
     duration = Column(String)
-    prescribed_by = Column(String)  # Doctor name
+    prescribed_by = Column(String)  # Doctor name at the time of writing
+    prescribed_by_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
     date_prescribed = Column(String)  # Format: YYYY-MM-DD
     status = Column(String, default="Active")  # Active, Completed, Cancelled
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    deleted_at = Column(DateTime, nullable=True, index=True)  # Set instead of deleting the row
     
     # Relationships
     patient = relationship("Patient", back_populates="prescriptions")
     medical_record = relationship("MedicalRecord")
 
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    
+    key = Column(String, primary_key=True)  # sha256 of client, method, path and header value
+    request_hash = Column(String)
+    status_code = Column(Integer, nullable=True)  # NULL while the first request is running
+    reserved_at = Column(DateTime, nullable=True)  # When the running request took the key
+    content_type = Column(String, nullable=True)
+    response_body = Column(LargeBinary, nullable=True)
+    expires_at = Column(DateTime, index=True)
+
+class Job(Base):
+    __tablename__ = "jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String)  # export, import_patients, summary_report, backup
+    params = Column(String)  # JSON
+    status = Column(String, default="queued", index=True)  # queued, running, completed, failed, cancelled
+    progress = Column(Float, default=0.0)  # 0.0 to 1.0
+    message = Column(String, nullable=True)
+    error = Column(String, nullable=True)
+    result_path = Column(String, nullable=True)
+    cancel_requested = Column(Boolean, default=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+# Archive tables: completed records and appointments are moved here by
+# archive_records.py once they are older than ARCHIVE_AFTER_DAYS
+class ArchivedMedicalRecord(Base):
+    __tablename__ = "medical_records_archive"
+    
+    id = Column(Integer, primary_key=True)  # Same id as the original row
+    patient_id = Column(Integer, index=True)
+    date = Column(String, index=True)
+    doctor = Column(String)
+    doctor_id = Column(Integer, nullable=True, index=True)
+    diagnosis = Column(String)
+    treatment = Column(String)
+    observations = Column(String, nullable=True)
+    status = Column(String)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    deleted_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+class ArchivedAppointment(Base):
+    __tablename__ = "appointments_archive"
+    
+    id = Column(Integer, primary_key=True)  # Same id as the original row
+    patient_id = Column(Integer, index=True)
+    date = Column(String, index=True)
+    time = Column(String)
+    doctor = Column(String)
+    doctor_id = Column(Integer, nullable=True, index=True)
+    reason = Column(String)
+    status = Column(String)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    deleted_at = Column(DateTime, nullable=True)
+    owner_id = Column(Integer)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+# Analytics rollups, kept up to date by the write handlers (see track_appointment
+# and track_prescription) and rebuilt from scratch by rebuild_rollups.py
+class AppointmentDailyRollup(Base):
+    __tablename__ = "appointment_daily_rollups"
+    
+    # Keyed on the doctor's user id (names are looked up when read); appointments
+    # not linked to a user have doctor_id 0 and are keyed on their doctor string
+    doctor_id = Column(Integer, primary_key=True)
+    doctor = Column(String, primary_key=True)
+    date = Column(String, primary_key=True, index=True)  # Format: YYYY-MM-DD
+    status = Column(String, primary_key=True)
+    count = Column(Integer, default=0)
+
+class PrescriptionDailyRollup(Base):
+    __tablename__ = "prescription_daily_rollups"
+    
+    medication = Column(String, primary_key=True)
+    date = Column(String, primary_key=True, index=True)  # date_prescribed, YYYY-MM-DD
+    status = Column(String, primary_key=True)
+    count = Column(Integer, default=0)
+
+# Deletion tombstones for /sync: one row per patient or appointment that was
+# deleted or archived, so that offline clients can drop their copy
+class SyncTombstone(Base):
+    __tablename__ = "sync_tombstones"
+    
+    id = Column(Integer, primary_key=True)  # Sync position: tombstones are read in id order
+    resource_type = Column(String)  # patient, appointment
+    resource_id = Column(Integer)
+    deleted_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+def ensure_columns(bind):
+    """Add columns and indexes introduced after a table was first created.
+
+    create_all() only creates missing tables, so databases created by an older
+    version of the app are upgraded in place here.
+    """
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=bind.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+# Rollups are derived data: a table with the old name-only key is dropped and rebuilt at startup
+if "appointment_daily_rollups" in inspect(engine).get_table_names() and "doctor_id" not in {
+    column["name"] for column in inspect(engine).get_columns("appointment_daily_rollups")
+}:
+    AppointmentDailyRollup.__table__.drop(bind=engine)
+
 # Create tables
 Base.metadata.create_all(bind=engine)
+ensure_columns(engine)
+
+# WAL lets readers, including online backups (backup.py), run alongside writers
+with engine.connect() as conn:
+    conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+
+# Year partitions: partitions.py moves closed years of medical records and
+# appointments (live and archived rows) out of the main database into one
+# SQLite file per year. Reads attach only the files a date range needs, and
+# partitioned rows are read-only through the API.
+PARTITIONS_DIR = os.getenv("PARTITIONS_DIR", "./partitions")
+DETACHED_PARTITIONS_DIR = os.path.join(PARTITIONS_DIR, "detached")
+PARTITIONED_MODELS = (MedicalRecord, ArchivedMedicalRecord, Appointment, ArchivedAppointment)
+MAX_ATTACHED_PARTITIONS = 10  # SQLite's default limit on attached databases per connection
+
+def partition_path(year: int, directory: str = PARTITIONS_DIR) -> str:
+    return os.path.join(directory, f"{year}.db")
+
+def partition_years(directory: str = PARTITIONS_DIR) -> List[int]:
+    """Years that have a partition file in `directory` (detached ones are in DETACHED_PARTITIONS_DIR)."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(int(name[:-3]) for name in os.listdir(directory) if name.endswith(".db") and name[:-3].isdigit())
+
+def partition_engine(year: int, directory: str = PARTITIONS_DIR):
+    return create_engine(f"sqlite:///{partition_path(year, directory)}")
+
+_partition_tables = {}
+
+def partition_table(model, year: int) -> Table:
+    """The model's table inside the partition for `year`, as attached by attach_partitions."""
+    key = (model.__tablename__, year)
+    if key not in _partition_tables:
+        columns = [Column(column.name, column.type) for column in model.__table__.columns]
+        _partition_tables[key] = Table(model.__tablename__, MetaData(), *columns, schema=f"partition_{year}")
+    return _partition_tables[key]
+
+def attach_partitions(db: Session, years):
+    """Attach the partition files for `years` to the session's connection.
+
+    SQLite cannot attach inside a write transaction, so call this before the
+    session writes. Attachments stay on the pooled connection for later
+    requests; partitions detached since then are dropped here.
+    """
+    connection = db.connection()
+    attached = connection.info.setdefault("partitions", set())
+    stale = attached - set(partition_years())
+    if len(attached | set(years)) > MAX_ATTACHED_PARTITIONS:
+        stale |= attached - set(years)
+    for year in stale:
+        connection.exec_driver_sql(f"DETACH DATABASE partition_{year}")
+        attached.discard(year)
+    for year in years:
+        if year not in attached:
+            connection.exec_driver_sql(f"ATTACH DATABASE ? AS partition_{year}", (partition_path(year),))
+            attached.add(year)
+
+for year in partition_years():
+    # Partition files written by an older version get new columns too
+    upgrade_engine = partition_engine(year)
+    ensure_columns(upgrade_engine)
+    upgrade_engine.dispose()
+
+# Staff directory: user names cached in memory, so rows that reference a doctor
+# by id show the doctor's current name without joining users. Refreshed by the
+# user routes, and every STAFF_DIRECTORY_TTL seconds for changes made elsewhere.
+staff_directory = StaffDirectory(SessionLocal, User, ttl=float(os.getenv("STAFF_DIRECTORY_TTL", "300")))
+
+# Audit log: events go to a separate, append-only SQLite database so that
+# flushing them never competes with clinical writes for the main database lock
+AUDIT_DATABASE_URL = os.getenv("AUDIT_DATABASE_URL", "sqlite:///./audit_log.db")
+audit_engine = create_engine(AUDIT_DATABASE_URL, connect_args={"check_same_thread": False})
+AuditSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=audit_engine)
+AuditBase = declarative_base()
+
+class AuditEvent(AuditBase):
+    __tablename__ = "audit_events"
+    
+    id = Column(Integer, primary_key=True)
+    occurred_at = Column(DateTime, index=True)
+    actor = Column(String)  # "user:<email>" from the JWT, or "ip:<address>"
+    action = Column(String)  # read, create, update, delete
+    resource_type = Column(String)  # medical_record, prescription
+    resource_id = Column(Integer, nullable=True)
+    patient_id = Column(Integer, nullable=True)
+    
+    __table_args__ = (
+        Index("ix_audit_events_actor_time", "actor", "occurred_at"),
+        Index("ix_audit_events_patient_time", "patient_id", "occurred_at"),
+    )
+
+AuditBase.metadata.create_all(bind=audit_engine)
+with audit_engine.begin() as conn:
+    for operation in ("UPDATE", "DELETE"):
+        conn.execute(text(
+            f"CREATE TRIGGER IF NOT EXISTS audit_events_no_{operation.lower()} BEFORE {operation} ON audit_events "
+            "BEGIN SELECT RAISE(ABORT, 'audit_events is append-only'); END"
+        ))
+
+audit_log = AuditLog(
+    AuditSessionLocal,
+    AuditEvent,
+    capacity=int(os.getenv("AUDIT_BUFFER_CAPACITY", "100000")),
+    batch_size=int(os.getenv("AUDIT_BATCH_SIZE", "500")),
+    flush_interval=float(os.getenv("AUDIT_FLUSH_INTERVAL", "2")),
+)
+
+def bump_rollup(db: Session, model, keys: dict, delta: int):
+    """Atomically add delta to a rollup counter, creating the row if needed."""
+    statement = sqlite_insert(model).values(**keys, count=delta)
+    statement = statement.on_conflict_do_update(index_elements=list(keys), set_={"count": model.count + delta})
+    db.execute(statement)
+
+def rollup_doctor(doctor_id, doctor) -> dict:
+    if doctor_id is not None:
+        return {"doctor_id": doctor_id, "doctor": ""}
+    return {"doctor_id": 0, "doctor": doctor or ""}
+
+def track_appointment(db: Session, appointment, delta: int):
+    keys = {**rollup_doctor(appointment.doctor_id, appointment.doctor), "date": appointment.date,
+            "status": appointment.status}
+    bump_rollup(db, AppointmentDailyRollup, keys, delta)
+
+def track_prescription(db: Session, prescription, delta: int):
+    keys = {"medication": prescription.medication, "date": prescription.date_prescribed, "status": prescription.status}
+    bump_rollup(db, PrescriptionDailyRollup, keys, delta)
+
+def count_appointments(db: Session, table, counts: Counter):
+    rows = db.execute(
+        select(table.c.doctor_id, table.c.doctor, table.c.date, table.c.status, func.count())
+        .where(table.c.deleted_at.is_(None))
+        .group_by(table.c.doctor_id, table.c.doctor, table.c.date, table.c.status)
+    )
+    for doctor_id, doctor, date, status, count in rows:
+        doctor_key = rollup_doctor(doctor_id, doctor)
+        counts[(doctor_key["doctor_id"], doctor_key["doctor"], date, status)] += count
+
+def rebuild_rollups(db: Session):
+    """Recompute every rollup from the source tables, archived and partitioned appointments included."""
+    # Partitions hold closed years that the API never writes to, so they are counted
+    # first, one at a time, so that any number of them can be read
+    appointment_counts = Counter()
+    for year in partition_years():
+        attach_partitions(db, [year])
+        for model in (Appointment, ArchivedAppointment):
+            count_appointments(db, partition_table(model, year), appointment_counts)
+    db.commit()
+    
+    # The live tables are counted and the rollups rewritten in one write transaction,
+    # so writes (and their rollup bumps) made meanwhile wait instead of being lost
+    db.execute(text("BEGIN IMMEDIATE"))
+    for model in (Appointment, ArchivedAppointment):
+        count_appointments(db, model.__table__, appointment_counts)
+    db.query(AppointmentDailyRollup).delete()
+    db.query(PrescriptionDailyRollup).delete()
+    
+    if appointment_counts:
+        db.execute(insert(AppointmentDailyRollup), [
+            {"doctor_id": doctor_id, "doctor": doctor, "date": date, "status": status, "count": count}
+            for (doctor_id, doctor, date, status), count in appointment_counts.items()
+        ])
+    db.execute(insert(PrescriptionDailyRollup).from_select(
+        ["medication", "date", "status", "count"],
+        select(Prescription.medication, Prescription.date_prescribed, Prescription.status, func.count())
+        .where(Prescription.deleted_at.is_(None))
+        .group_by(Prescription.medication, Prescription.date_prescribed, Prescription.status),
+    ))
+    db.commit()
 
 # Dependency to get DB session
-def get_db():
+def get_db(request: Request):
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+    if request.method not in ("GET", "HEAD"):
+        recent_writers.mark_write(client_key(request.scope))
+
+# Dependency to identify who is making the request, for the audit log
+def get_actor(request: Request):
+    return client_key(request.scope)
+
+# Dependency to get a read-only DB session (replica, or primary right after a write)
+def get_read_db(request: Request):
+    if recent_writers.wrote_recently(client_key(request.scope)):
+        db = SessionLocal()
+    else:
+        db = ReplicaSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
 
 # Pydantic models for request/response
-from pydantic import BaseModel
+from pydantic import BaseModel, model_validator
 from typing import Optional
 
 class UserBase(BaseModel):
@@ -189,6 +522,17 @@ class PatientResponse(PatientBase):
     owner_id: Optional[int] = None
     created_at: datetime
     updated_at: datetime
+    deleted_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+class PatientSummary(BaseModel):
+    id: int
+    name: str
+    date_of_birth: Optional[str] = None
+    gender: Optional[str] = None
+    blood_type: Optional[str] = None
     
     class Config:
         from_attributes = True
@@ -197,17 +541,19 @@ class MedicalRecordBase(BaseModel):
     patient_id: int
     date: str
     doctor: str
+    doctor_id: Optional[int] = None
     diagnosis: str
     treatment: str
     observations: Optional[str] = None
     status: str = "In Progress"
 
 class MedicalRecordCreate(MedicalRecordBase):
-    pass
+    doctor: Optional[str] = None  # Taken from doctor_id when omitted
 
 class MedicalRecordUpdate(BaseModel):
     date: Optional[str] = None
     doctor: Optional[str] = None
+    doctor_id: Optional[int] = None
     diagnosis: Optional[str] = None
     treatment: Optional[str] = None
     observations: Optional[str] = None
@@ -217,26 +563,37 @@ class MedicalRecordResponse(MedicalRecordBase):
     id: int
     created_at: datetime
     updated_at: datetime
+    deleted_at: Optional[datetime] = None
     
     class Config:
         from_attributes = True
+    
+    @model_validator(mode="after")
+    def current_doctor_name(self):
+        self.doctor = staff_directory.name(self.doctor_id) or self.doctor
+        return self
+
+class MedicalRecordWithPatient(MedicalRecordResponse):
+    patient: Optional[PatientSummary] = None  # Only filled in with expand=patient
 
 class AppointmentBase(BaseModel):
     patient_id: int
     date: str
     time: str
     doctor: str
+    doctor_id: Optional[int] = None
     reason: str
     status: str = "Scheduled"
 
 class AppointmentCreate(AppointmentBase):
-    pass
+    doctor: Optional[str] = None  # Taken from doctor_id when omitted
 
 class AppointmentUpdate(BaseModel):
     patient_id: Optional[int] = None
     date: Optional[str] = None
     time: Optional[str] = None
     doctor: Optional[str] = None
+    doctor_id: Optional[int] = None
     reason: Optional[str] = None
     status: Optional[str] = None
 
@@ -245,9 +602,18 @@ class AppointmentResponse(AppointmentBase):
     owner_id: Optional[int] = None
     created_at: datetime
     updated_at: datetime
+    deleted_at: Optional[datetime] = None
     
     class Config:
         from_attributes = True
+    
+    @model_validator(mode="after")
+    def current_doctor_name(self):
+        self.doctor = staff_directory.name(self.doctor_id) or self.doctor
+        return self
+
+class AppointmentWithPatient(AppointmentResponse):
+    patient: Optional[PatientSummary] = None  # Only filled in with expand=patient
 
 class PrescriptionBase(BaseModel):
     record_id: int
@@ -257,11 +623,12 @@ class PrescriptionBase(BaseModel):
     frequency: str
     duration: str
     prescribed_by: str
+    prescribed_by_id: Optional[int] = None
     date_prescribed: str
     status: str = "Active"
 
 class PrescriptionCreate(PrescriptionBase):
-    pass
+    prescribed_by: Optional[str] = None  # Taken from prescribed_by_id when omitted
 
 class PrescriptionUpdate(BaseModel):
     record_id: Optional[int] = None
@@ -271,6 +638,7 @@ class PrescriptionUpdate(BaseModel):
     frequency: Optional[str] = None
     duration: Optional[str] = None
     prescribed_by: Optional[str] = None
+    prescribed_by_id: Optional[int] = None
     date_prescribed: Optional[str] = None
     status: Optional[str] = None
 
@@ -278,6 +646,83 @@ class PrescriptionResponse(PrescriptionBase):
     id: int
     created_at: datetime
     updated_at: datetime
+    deleted_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+    
+    @model_validator(mode="after")
+    def current_prescriber_name(self):
+        self.prescribed_by = staff_directory.name(self.prescribed_by_id) or self.prescribed_by
+        return self
+
+class PrescriptionWithPatient(PrescriptionResponse):
+    patient: Optional[PatientSummary] = None  # Only filled in with expand=patient
+
+class SyncTombstoneResponse(BaseModel):
+    resource_type: str
+    resource_id: int
+    deleted_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+class SyncResponse(BaseModel):
+    patients: List[PatientResponse]  # Created or updated since the token
+    appointments: List[AppointmentResponse]
+    deleted: List[SyncTombstoneResponse]
+    next_token: str  # Pass as since= on the next call
+    has_more: bool  # True until the backlog is drained; call again right away with next_token
+
+class JobCreate(BaseModel):
+    kind: str
+    params: dict = {}
+
+class JobResponse(BaseModel):
+    id: int
+    kind: str
+    status: str
+    progress: float
+    message: Optional[str] = None
+    error: Optional[str] = None
+    cancel_requested: bool
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    
+    class Config:
+        from_attributes = True
+
+class AppointmentVolume(BaseModel):
+    doctor: str
+    doctor_id: Optional[int] = None
+    date: str
+    total: int
+    by_status: dict
+
+class AppointmentRates(BaseModel):
+    doctor: str
+    doctor_id: Optional[int] = None
+    total: int
+    completed: int
+    cancelled: int
+    no_show: int
+    cancellation_rate: float
+    no_show_rate: float
+
+class MedicationCount(BaseModel):
+    medication: str
+    total: int
+    by_status: dict
+
+class AuditEventResponse(BaseModel):
+    id: int
+    occurred_at: datetime
+    actor: Optional[str] = None
+    action: str
+    resource_type: str
+    resource_id: Optional[int] = None
+    patient_id: Optional[int] = None
     
     class Config:
         from_attributes = True
@@ -292,6 +737,61 @@ SECRET_KEY = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Rate limiting: separate budgets (requests per minute, burst) per client for
+# reads, writes and login, plus a global cap on concurrent requests
+RATE_LIMIT_BUDGETS = {
+    "read": (int(os.getenv("RATE_LIMIT_READ_PER_MINUTE", "600")), int(os.getenv("RATE_LIMIT_READ_BURST", "100"))),
+    "write": (int(os.getenv("RATE_LIMIT_WRITE_PER_MINUTE", "120")), int(os.getenv("RATE_LIMIT_WRITE_BURST", "30"))),
+    "token": (int(os.getenv("RATE_LIMIT_TOKEN_PER_MINUTE", "10")), int(os.getenv("RATE_LIMIT_TOKEN_BURST", "5"))),
+}
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "64"))
+
+IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+IDEMPOTENCY_LEASE_SECONDS = int(os.getenv("IDEMPOTENCY_LEASE_SECONDS", "60"))
+
+# Middleware, innermost first: each add_middleware call wraps the previous ones
+client_key = make_client_key(SECRET_KEY, ALGORITHM)
+
+# Replay stored responses for retried POST/PUT requests carrying an Idempotency-Key
+app.add_middleware(
+    IdempotencyMiddleware,
+    session_factory=SessionLocal,
+    model=IdempotencyKey,
+    key_func=client_key,
+    ttl=timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS),
+    lease=timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS),
+    # Login responses are bearer tokens: never store or replay them
+    excluded_paths={"/token"},
+)
+
+# Compress large responses (e.g. medical record lists) for clinics on slow links
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024")),
+    gzip_level=int(os.getenv("COMPRESSION_GZIP_LEVEL", "6")),
+    brotli_quality=int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4")),
+    content_types=os.getenv(
+        "COMPRESSION_CONTENT_TYPES", "application/json,application/x-ndjson,text/"
+    ).split(","),
+)
+
+# Enforce the rate limits above and shed load when too many requests are in flight
+app.add_middleware(
+    RateLimitMiddleware,
+    limiter=RateLimiter(RATE_LIMIT_BUDGETS),
+    key_func=client_key,
+    max_concurrency=MAX_CONCURRENT_REQUESTS,
+)
+
+# Add CORS middleware to allow requests from frontend
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # In production, specify your frontend URL
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def verify_password(plain_password, hashed_password):
@@ -316,6 +816,235 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+# For routes where only some requests need a token (see ADMIN_JOB_KINDS)
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
+
+def admin_user(db: Session, token: Optional[str]):
+    """The active Administrator a bearer token belongs to; 401 for a bad token, 403 for other roles."""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    if not token:
+        raise credentials_exception
+    try:
+        email = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("sub")
+    except JWTError:
+        raise credentials_exception
+    user = db.query(User).filter(User.email == email).first() if email else None
+    if user is None or not user.is_active:
+        raise credentials_exception
+    if user.role != "Administrator":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Administrator role required")
+    return user
+
+# Dependency for admin-only routes
+def get_current_admin(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    return admin_user(db, token)
+
+def filter_dates(query, model, date_from: Optional[str], date_to: Optional[str]):
+    if date_from:
+        query = query.filter(model.date >= date_from)
+    if date_to:
+        query = query.filter(model.date <= date_to)
+    return query
+
+def partitions_for(date_from: Optional[str], date_to: Optional[str]) -> List[int]:
+    """Partition years a date range overlaps; every active partition when the range is open."""
+    try:
+        first = int(date_from[:4]) if date_from else None
+        last = int(date_to[:4]) if date_to else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date_from and date_to must be YYYY-MM-DD")
+    return [year for year in partition_years()
+            if (first is None or year >= first) and (last is None or year <= last)]
+
+def query_partitioned(db: Session, model, archive_model, include_deleted: bool, include_archived: bool,
+                      years: List[int], skip: int, limit: int, names: Optional[List[str]] = None,
+                      expand_patient: bool = False, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                      doctor_id: Optional[int] = None):
+    """Page through live rows, archived rows if requested and the given year partitions together, ordered by id.
+
+    A connection can only attach MAX_ATTACHED_PARTITIONS partitions, so longer
+    ranges are read in groups, each returning its first skip + limit rows, and
+    the groups are merged by id.
+    """
+    # id is always selected because the combined rows are ordered by it
+    if names:
+        names = with_staff_ids(model, list(dict.fromkeys(["id", "patient_id", *names])))
+    else:
+        names = [column.name for column in model.__table__.columns]
+    models = (model, archive_model) if include_archived else (model,)
+    groups = [years[start:start + MAX_ATTACHED_PARTITIONS] for start in range(0, len(years), MAX_ATTACHED_PARTITIONS)]
+    if len(groups) <= 1:
+        tables = [source.__table__ for source in models]
+        if years:
+            attach_partitions(db, years)
+            tables += [partition_table(source, year) for year in years for source in models]
+        return select_partitioned(db, tables, names, include_deleted, skip, limit, expand_patient, date_from,
+                                  date_to, doctor_id)
+    
+    rows = []
+    for index, group in enumerate(groups):
+        tables = [source.__table__ for source in models] if index == 0 else []
+        attach_partitions(db, group)
+        tables += [partition_table(source, year) for year in group for source in models]
+        rows += select_partitioned(db, tables, names, include_deleted, 0, skip + limit, expand_patient, date_from,
+                                   date_to, doctor_id)
+    rows.sort(key=lambda row: row.id)
+    return rows[skip:skip + limit]
+
+def select_partitioned(db: Session, tables, names: List[str], include_deleted: bool, skip: int, limit: int,
+                       expand_patient: bool, date_from: Optional[str], date_to: Optional[str],
+                       doctor_id: Optional[int]):
+    selects = []
+    for table in tables:
+        query = select(*[table.c[name] for name in names])
+        if not include_deleted:
+            query = query.where(table.c.deleted_at.is_(None), patient_not_deleted(table.c.patient_id))
+        if date_from:
+            query = query.where(table.c.date >= date_from)
+        if date_to:
+            query = query.where(table.c.date <= date_to)
+        if doctor_id is not None:
+            query = query.where(table.c.doctor_id == doctor_id)
+        selects.append(query)
+    combined = (union_all(*selects) if len(selects) > 1 else selects[0]).subquery()
+    query = select(combined)
+    if expand_patient:
+        query = query.add_columns(*patient_summary_columns()).select_from(
+            combined.outerjoin(Patient, and_(Patient.id == combined.c.patient_id, Patient.deleted_at.is_(None)))
+        )
+    query = query.order_by(combined.c.id).offset(skip).limit(limit)
+    return db.execute(query).all()
+
+def find_in_partitions(db: Session, model, archive_model, row_id: int, include_archived: bool,
+                       names: Optional[List[str]] = None):
+    """Look a row up by id in the year partitions, newest year first."""
+    names = with_staff_ids(model, names) if names else [column.name for column in model.__table__.columns]
+    models = (model, archive_model) if include_archived else (model,)
+    for year in reversed(partition_years()):
+        attach_partitions(db, [year])
+        for source in models:
+            table = partition_table(source, year)
+            row = db.execute(
+                select(*[table.c[name] for name in names]).where(
+                    table.c.id == row_id, table.c.deleted_at.is_(None), patient_not_deleted(table.c.patient_id)
+                )
+            ).first()
+            if row is not None:
+                return row
+    return None
+
+# Embedding related patients: list routes accept expand=patient to return a
+# patient summary with each row, joined in the same query
+PATIENT_SUMMARY_FIELDS = ("id", "name", "date_of_birth", "gender", "blood_type")
+
+def parse_expand(expand: Optional[str]) -> bool:
+    names = {name.strip() for name in (expand or "").split(",") if name.strip()}
+    unknown = names - {"patient"}
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Cannot expand: {', '.join(sorted(unknown))}")
+    return "patient" in names
+
+def patient_summary_columns():
+    return [getattr(Patient, name).label(f"patient__{name}") for name in PATIENT_SUMMARY_FIELDS]
+
+def patient_not_deleted(patient_id):
+    """Condition that drops rows belonging to a soft-deleted patient."""
+    return patient_id.notin_(select(Patient.id).where(Patient.deleted_at.isnot(None)))
+
+def live_patient_join(model):
+    return and_(Patient.id == model.patient_id, Patient.deleted_at.is_(None))
+
+def with_patient_columns(query, model):
+    """Outer join the patient summary columns onto a column (non-ORM) query."""
+    return query.outerjoin(Patient, live_patient_join(model)).add_columns(*patient_summary_columns())
+
+def load_patient(query, model, expand_patient: bool):
+    """Eager load a patient summary onto ORM rows, or make sure it is never lazy loaded."""
+    if not expand_patient:
+        return query.options(noload(model.patient))
+    # A soft-deleted patient is never embedded
+    return query.outerjoin(Patient, live_patient_join(model)).options(
+        contains_eager(model.patient).load_only(*[getattr(Patient, name) for name in PATIENT_SUMMARY_FIELDS])
+    )
+
+def patient_summary(row) -> Optional[dict]:
+    mapping = row._mapping
+    if mapping["patient__id"] is None:
+        return None
+    return {name: mapping[f"patient__{name}"] for name in PATIENT_SUMMARY_FIELDS}
+
+def row_with_patient(row) -> dict:
+    data = {key: value for key, value in row._mapping.items() if not key.startswith("patient__")}
+    data["patient"] = patient_summary(row)
+    return data
+
+# Sparse field selection: read routes accept fields=a,b,c to narrow both the
+# SQL column list and the response body
+def parse_fields(fields: Optional[str], model, response_model) -> Optional[List[str]]:
+    if not fields:
+        return None
+    names = list(dict.fromkeys(name.strip() for name in fields.split(",") if name.strip()))
+    unknown = [
+        name for name in names
+        if name not in response_model.model_fields or name not in model.__table__.columns
+    ]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return names
+
+def query_fields(db: Session, model, names: Optional[List[str]], required=()):
+    """Query whole objects, or only the named columns plus `required` ones."""
+    if not names:
+        return db.query(model)
+    columns = with_staff_ids(model, list(dict.fromkeys([*names, *required])))
+    return db.query(*[getattr(model, name) for name in columns])
+
+# Staff name columns and the users.id column their current name is looked up by
+STAFF_NAME_FIELDS = {"doctor": "doctor_id", "prescribed_by": "prescribed_by_id"}
+
+def with_staff_ids(model, names: List[str]) -> List[str]:
+    ids = [
+        STAFF_NAME_FIELDS[name] for name in names
+        if name in STAFF_NAME_FIELDS and STAFF_NAME_FIELDS[name] in model.__table__.columns
+    ]
+    return list(dict.fromkeys([*names, *ids]))
+
+def link_staff(values: dict, name_field: str, id_field: str) -> dict:
+    """Fill in the name from the user id, or match a free-text name to a user."""
+    if values.get(id_field) is not None:
+        name = staff_directory.name(values[id_field])
+        if name is None:
+            raise HTTPException(status_code=400, detail=f"Unknown {id_field}")
+        values[name_field] = name
+    elif values.get(name_field):
+        values[id_field] = staff_directory.resolve(values[name_field])
+    elif name_field in values:
+        raise HTTPException(status_code=400, detail=f"{name_field} or {id_field} is required")
+    return values
+
+def sparse_response(data, names: List[str], expand_patient: bool = False):
+    def sparse_row(row):
+        content = {name: getattr(row, name) for name in names}
+        for name, id_field in STAFF_NAME_FIELDS.items():
+            if name in content:
+                content[name] = staff_directory.name(getattr(row, id_field, None)) or content[name]
+        if expand_patient:
+            content["patient"] = patient_summary(row)
+        return content
+    
+    if isinstance(data, list):
+        content = [sparse_row(row) for row in data]
+    else:
+        content = sparse_row(data)
+    return JSONResponse(jsonable_encoder(content))
+
 # Routes
 
 @app.get("/")
@@ -346,14 +1075,18 @@ def create_user(user: UserCreate, db: Session = Depends(get_db)):
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    staff_directory.refresh()
     
     return db_user
 
 @app.get("/users/{user_id}", response_model=UserResponse)
-def get_user(user_id: int, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == user_id).first()
+def get_user(user_id: int, db: Session = Depends(get_read_db), fields: Optional[str] = None):
+    names = parse_fields(fields, User, UserResponse)
+    user = query_fields(db, User, names).filter(User.id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
+    if names:
+        return sparse_response(user, names)
     return user
 
 @app.put("/users/{user_id}", response_model=UserResponse)
@@ -368,6 +1101,7 @@ def update_user(user_id: int, user_update: UserUpdate, db: Session = Depends(get
     
     db.commit()
     db.refresh(db_user)
+    staff_directory.refresh()
     return db_user
 
 @app.delete("/users/{user_id}")
@@ -378,6 +1112,7 @@ def delete_user(user_id: int, db: Session = Depends(get_db)):
     
     db.delete(user)
     db.commit()
+    staff_directory.refresh()
     return {"message": "User deleted successfully"}
 
 # User routes
@@ -386,13 +1121,16 @@ def create_user_endpoint(user: UserCreate, db: Session = Depends(get_db)):
     return create_user(user, db)
 
 @app.get("/users", response_model=List[UserResponse])
-def get_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = db.query(User).offset(skip).limit(limit).all()
+def get_users(skip: int = 0, limit: int = 100, fields: Optional[str] = None, db: Session = Depends(get_read_db)):
+    names = parse_fields(fields, User, UserResponse)
+    users = query_fields(db, User, names).offset(skip).limit(limit).all()
+    if names:
+        return sparse_response(users, names)
     return users
 
 @app.get("/users/{user_id}", response_model=UserResponse)
-def get_user_endpoint(user_id: int, db: Session = Depends(get_db)):
-    return get_user(user_id, db)
+def get_user_endpoint(user_id: int, db: Session = Depends(get_read_db), fields: Optional[str] = None):
+    return get_user(user_id, db, fields)
 
 @app.put("/users/{user_id}", response_model=UserResponse)
 def update_user_endpoint(user_id: int, user_update: UserUpdate, db: Session = Depends(get_db)):
@@ -403,6 +1141,8 @@ def delete_user_endpoint(user_id: int, db: Session = Depends(get_db)):
     return delete_user(user_id, db)
 
 # Patient routes
+MAX_BATCH_IDS = 1000
+
 @app.post("/patients", response_model=PatientResponse)
 def create_patient(patient: PatientCreate, db: Session = Depends(get_db)):
     # In a real app, you would get the current user from the token
@@ -416,20 +1156,40 @@ def create_patient(patient: PatientCreate, db: Session = Depends(get_db)):
     return db_patient
 
 @app.get("/patients", response_model=List[PatientResponse])
-def get_patients(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    patients = db.query(Patient).offset(skip).limit(limit).all()
+def get_patients(skip: int = 0, limit: int = 100, include_deleted: bool = False, fields: Optional[str] = None,
+                 ids: Optional[str] = None, db: Session = Depends(get_read_db)):
+    names = parse_fields(fields, Patient, PatientResponse)
+    query = query_fields(db, Patient, names)
+    if not include_deleted:
+        query = query.filter(Patient.deleted_at.is_(None))
+    if ids:
+        # Batch lookup: ?ids=1,2,3 returns just those patients, without paging
+        try:
+            patient_ids = {int(patient_id) for patient_id in ids.split(",") if patient_id.strip()}
+        except ValueError:
+            raise HTTPException(status_code=400, detail="ids must be a comma-separated list of integers")
+        if len(patient_ids) > MAX_BATCH_IDS:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IDS} ids can be requested at once")
+        patients = query.filter(Patient.id.in_(patient_ids)).order_by(Patient.id).all()
+    else:
+        patients = query.offset(skip).limit(limit).all()
+    if names:
+        return sparse_response(patients, names)
     return patients
 
 @app.get("/patients/{patient_id}", response_model=PatientResponse)
-def get_patient(patient_id: int, db: Session = Depends(get_db)):
-    patient = db.query(Patient).filter(Patient.id == patient_id).first()
+def get_patient(patient_id: int, fields: Optional[str] = None, db: Session = Depends(get_read_db)):
+    names = parse_fields(fields, Patient, PatientResponse)
+    patient = query_fields(db, Patient, names).filter(Patient.id == patient_id, Patient.deleted_at.is_(None)).first()
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
+    if names:
+        return sparse_response(patient, names)
     return patient
 
 @app.put("/patients/{patient_id}", response_model=PatientResponse)
 def update_patient(patient_id: int, patient_update: PatientUpdate, db: Session = Depends(get_db)):
-    db_patient = db.query(Patient).filter(Patient.id == patient_id).first()
+    db_patient = db.query(Patient).filter(Patient.id == patient_id, Patient.deleted_at.is_(None)).first()
     if not db_patient:
         raise HTTPException(status_code=404, detail="Patient not found")
     
@@ -443,59 +1203,115 @@ def update_patient(patient_id: int, patient_update: PatientUpdate, db: Session =
 
 @app.delete("/patients/{patient_id}")
 def delete_patient(patient_id: int, db: Session = Depends(get_db)):
-    patient = db.query(Patient).filter(Patient.id == patient_id).first()
+    patient = db.query(Patient).filter(Patient.id == patient_id, Patient.deleted_at.is_(None)).first()
     if not patient:
         raise HTTPException(status_code=404, detail="Patient not found")
     
-    db.delete(patient)
+    patient.deleted_at = datetime.utcnow()
+    db.add(SyncTombstone(resource_type="patient", resource_id=patient.id))
+    # The API stops listing the patient's appointments, so offline clients drop them too
+    appointments = db.query(Appointment.id).filter(
+        Appointment.patient_id == patient.id, Appointment.deleted_at.is_(None)
+    ).all()
+    db.add_all([SyncTombstone(resource_type="appointment", resource_id=appointment.id)
+                for appointment in appointments])
     db.commit()
     return {"message": "Patient deleted successfully"}
 
 # Medical Record routes
 @app.post("/records", response_model=MedicalRecordResponse)
-def create_medical_record(record: MedicalRecordCreate, db: Session = Depends(get_db)):
-    db_record = MedicalRecord(**record.dict())
+def create_medical_record(record: MedicalRecordCreate, db: Session = Depends(get_db),
+                          actor: str = Depends(get_actor)):
+    db_record = MedicalRecord(**link_staff(record.dict(), "doctor", "doctor_id"))
     
     db.add(db_record)
     db.commit()
     db.refresh(db_record)
     
+    audit_log.record("create", "medical_record", db_record.id, db_record.patient_id, actor)
     return db_record
 
-@app.get("/records", response_model=List[MedicalRecordResponse])
-def get_medical_records(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    records = db.query(MedicalRecord).offset(skip).limit(limit).all()
+@app.get("/records", response_model=List[MedicalRecordWithPatient])
+def get_medical_records(skip: int = 0, limit: int = 100, include_deleted: bool = False,
+                        include_archived: bool = False, fields: Optional[str] = None, expand: Optional[str] = None,
+                        date_from: Optional[str] = None, date_to: Optional[str] = None, doctor_id: Optional[int] = None,
+                        db: Session = Depends(get_read_db), actor: str = Depends(get_actor)):
+    names = parse_fields(fields, MedicalRecord, MedicalRecordResponse)
+    expand_patient = parse_expand(expand)
+    # id and patient_id are always read for the audit log
+    audited = names and list(dict.fromkeys([*names, "id", "patient_id"]))
+    years = partitions_for(date_from, date_to)
+    combined = include_archived or bool(years)
+    if combined:
+        records = query_partitioned(db, MedicalRecord, ArchivedMedicalRecord, include_deleted, include_archived,
+                                    years, skip, limit, audited, expand_patient, date_from, date_to, doctor_id)
+    else:
+        if names:
+            query = query_fields(db, MedicalRecord, audited)
+            if expand_patient:
+                query = with_patient_columns(query, MedicalRecord)
+        else:
+            query = load_patient(db.query(MedicalRecord), MedicalRecord, expand_patient)
+        if not include_deleted:
+            query = query.filter(MedicalRecord.deleted_at.is_(None), patient_not_deleted(MedicalRecord.patient_id))
+        query = filter_dates(query, MedicalRecord, date_from, date_to)
+        if doctor_id is not None:
+            query = query.filter(MedicalRecord.doctor_id == doctor_id)
+        records = query.offset(skip).limit(limit).all()
+    for record in records:
+        audit_log.record("read", "medical_record", record.id, record.patient_id, actor)
+    if names:
+        return sparse_response(records, names, expand_patient)
+    if combined and expand_patient:
+        return [row_with_patient(record) for record in records]
     return records
 
 @app.get("/records/{record_id}", response_model=MedicalRecordResponse)
-def get_medical_record(record_id: int, db: Session = Depends(get_db)):
-    record = db.query(MedicalRecord).filter(MedicalRecord.id == record_id).first()
+def get_medical_record(record_id: int, include_archived: bool = False, fields: Optional[str] = None,
+                       db: Session = Depends(get_read_db), actor: str = Depends(get_actor)):
+    names = parse_fields(fields, MedicalRecord, MedicalRecordResponse)
+    record = query_fields(db, MedicalRecord, names, required=("id", "patient_id")).filter(
+        MedicalRecord.id == record_id, MedicalRecord.deleted_at.is_(None), patient_not_deleted(MedicalRecord.patient_id)
+    ).first()
+    if not record and include_archived:
+        record = query_fields(db, ArchivedMedicalRecord, names, required=("id", "patient_id")).filter(
+            ArchivedMedicalRecord.id == record_id, ArchivedMedicalRecord.deleted_at.is_(None), patient_not_deleted(ArchivedMedicalRecord.patient_id)
+        ).first()
+    if not record:
+        record = find_in_partitions(db, MedicalRecord, ArchivedMedicalRecord, record_id, include_archived,
+                                    names and list(dict.fromkeys([*names, "id", "patient_id"])))
     if not record:
         raise HTTPException(status_code=404, detail="Medical record not found")
+    audit_log.record("read", "medical_record", record.id, record.patient_id, actor)
+    if names:
+        return sparse_response(record, names)
     return record
 
 @app.put("/records/{record_id}", response_model=MedicalRecordResponse)
-def update_medical_record(record_id: int, record_update: MedicalRecordUpdate, db: Session = Depends(get_db)):
-    db_record = db.query(MedicalRecord).filter(MedicalRecord.id == record_id).first()
+def update_medical_record(record_id: int, record_update: MedicalRecordUpdate, db: Session = Depends(get_db),
+                          actor: str = Depends(get_actor)):
+    db_record = db.query(MedicalRecord).filter(MedicalRecord.id == record_id, MedicalRecord.deleted_at.is_(None)).first()
     if not db_record:
         raise HTTPException(status_code=404, detail="Medical record not found")
     
     # Update fields
-    for field, value in record_update.dict(exclude_unset=True).items():
+    for field, value in link_staff(record_update.dict(exclude_unset=True), "doctor", "doctor_id").items():
         setattr(db_record, field, value)
     
     db.commit()
     db.refresh(db_record)
+    audit_log.record("update", "medical_record", db_record.id, db_record.patient_id, actor)
     return db_record
 
 @app.delete("/records/{record_id}")
-def delete_medical_record(record_id: int, db: Session = Depends(get_db)):
-    record = db.query(MedicalRecord).filter(MedicalRecord.id == record_id).first()
+def delete_medical_record(record_id: int, db: Session = Depends(get_db), actor: str = Depends(get_actor)):
+    record = db.query(MedicalRecord).filter(MedicalRecord.id == record_id, MedicalRecord.deleted_at.is_(None)).first()
     if not record:
         raise HTTPException(status_code=404, detail="Medical record not found")
     
-    db.delete(record)
+    record.deleted_at = datetime.utcnow()
     db.commit()
+    audit_log.record("delete", "medical_record", record.id, record.patient_id, actor)
     return {"message": "Medical record deleted successfully"}
 
 # Appointment routes
@@ -503,35 +1319,76 @@ def delete_medical_record(record_id: int, db: Session = Depends(get_db)):
 def create_appointment(appointment: AppointmentCreate, db: Session = Depends(get_db)):
     # In a real app, you would get the current user from the token
     # For now, using a default user ID
-    db_appointment = Appointment(**appointment.dict(), owner_id=1)  # Assuming default user
+    db_appointment = Appointment(**link_staff(appointment.dict(), "doctor", "doctor_id"), owner_id=1)  # Assuming default user
     
     db.add(db_appointment)
+    track_appointment(db, db_appointment, 1)
     db.commit()
     db.refresh(db_appointment)
     
     return db_appointment
 
-@app.get("/appointments", response_model=List[AppointmentResponse])
-def get_appointments(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    appointments = db.query(Appointment).offset(skip).limit(limit).all()
+@app.get("/appointments", response_model=List[AppointmentWithPatient])
+def get_appointments(skip: int = 0, limit: int = 100, include_deleted: bool = False,
+                     include_archived: bool = False, fields: Optional[str] = None, expand: Optional[str] = None,
+                     date_from: Optional[str] = None, date_to: Optional[str] = None, doctor_id: Optional[int] = None,
+                     db: Session = Depends(get_read_db)):
+    names = parse_fields(fields, Appointment, AppointmentResponse)
+    expand_patient = parse_expand(expand)
+    years = partitions_for(date_from, date_to)
+    combined = include_archived or bool(years)
+    if combined:
+        appointments = query_partitioned(db, Appointment, ArchivedAppointment, include_deleted, include_archived,
+                                         years, skip, limit, names, expand_patient, date_from, date_to, doctor_id)
+    else:
+        if names:
+            query = query_fields(db, Appointment, names, required=("patient_id",) if expand_patient else ())
+            if expand_patient:
+                query = with_patient_columns(query, Appointment)
+        else:
+            query = load_patient(db.query(Appointment), Appointment, expand_patient)
+        if not include_deleted:
+            query = query.filter(Appointment.deleted_at.is_(None), patient_not_deleted(Appointment.patient_id))
+        query = filter_dates(query, Appointment, date_from, date_to)
+        if doctor_id is not None:
+            query = query.filter(Appointment.doctor_id == doctor_id)
+        appointments = query.offset(skip).limit(limit).all()
+    if names:
+        return sparse_response(appointments, names, expand_patient)
+    if combined and expand_patient:
+        return [row_with_patient(appointment) for appointment in appointments]
     return appointments
 
 @app.get("/appointments/{appointment_id}", response_model=AppointmentResponse)
-def get_appointment(appointment_id: int, db: Session = Depends(get_db)):
-    appointment = db.query(Appointment).filter(Appointment.id == appointment_id).first()
+def get_appointment(appointment_id: int, include_archived: bool = False, fields: Optional[str] = None,
+                    db: Session = Depends(get_read_db)):
+    names = parse_fields(fields, Appointment, AppointmentResponse)
+    appointment = query_fields(db, Appointment, names).filter(
+        Appointment.id == appointment_id, Appointment.deleted_at.is_(None), patient_not_deleted(Appointment.patient_id)
+    ).first()
+    if not appointment and include_archived:
+        appointment = query_fields(db, ArchivedAppointment, names).filter(
+            ArchivedAppointment.id == appointment_id, ArchivedAppointment.deleted_at.is_(None), patient_not_deleted(ArchivedAppointment.patient_id)
+        ).first()
+    if not appointment:
+        appointment = find_in_partitions(db, Appointment, ArchivedAppointment, appointment_id, include_archived, names)
     if not appointment:
         raise HTTPException(status_code=404, detail="Appointment not found")
+    if names:
+        return sparse_response(appointment, names)
     return appointment
 
 @app.put("/appointments/{appointment_id}", response_model=AppointmentResponse)
 def update_appointment(appointment_id: int, appointment_update: AppointmentUpdate, db: Session = Depends(get_db)):
-    db_appointment = db.query(Appointment).filter(Appointment.id == appointment_id).first()
+    db_appointment = db.query(Appointment).filter(Appointment.id == appointment_id, Appointment.deleted_at.is_(None)).first()
     if not db_appointment:
         raise HTTPException(status_code=404, detail="Appointment not found")
     
-    # Update fields
-    for field, value in appointment_update.dict(exclude_unset=True).items():
+    # Update fields, moving the appointment to its new rollup bucket
+    track_appointment(db, db_appointment, -1)
+    for field, value in link_staff(appointment_update.dict(exclude_unset=True), "doctor", "doctor_id").items():
         setattr(db_appointment, field, value)
+    track_appointment(db, db_appointment, 1)
     
     db.commit()
     db.refresh(db_appointment)
@@ -539,66 +1396,451 @@ def update_appointment(appointment_id: int, appointment_update: AppointmentUpdat
 
 @app.delete("/appointments/{appointment_id}")
 def delete_appointment(appointment_id: int, db: Session = Depends(get_db)):
-    appointment = db.query(Appointment).filter(Appointment.id == appointment_id).first()
+    appointment = db.query(Appointment).filter(Appointment.id == appointment_id, Appointment.deleted_at.is_(None)).first()
     if not appointment:
         raise HTTPException(status_code=404, detail="Appointment not found")
     
-    db.delete(appointment)
+    appointment.deleted_at = datetime.utcnow()
+    track_appointment(db, appointment, -1)
+    db.add(SyncTombstone(resource_type="appointment", resource_id=appointment.id))
     db.commit()
     return {"message": "Appointment deleted successfully"}
 
 # Prescription routes
 @app.post("/prescriptions", response_model=PrescriptionResponse)
-def create_prescription(prescription: PrescriptionCreate, db: Session = Depends(get_db)):
-    db_prescription = Prescription(**prescription.dict())
+def create_prescription(prescription: PrescriptionCreate, db: Session = Depends(get_db),
+                        actor: str = Depends(get_actor)):
+    db_prescription = Prescription(**link_staff(prescription.dict(), "prescribed_by", "prescribed_by_id"))
     
     db.add(db_prescription)
+    track_prescription(db, db_prescription, 1)
     db.commit()
     db.refresh(db_prescription)
     
+    audit_log.record("create", "prescription", db_prescription.id, db_prescription.patient_id, actor)
     return db_prescription
 
-@app.get("/prescriptions", response_model=List[PrescriptionResponse])
-def get_prescriptions(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    prescriptions = db.query(Prescription).offset(skip).limit(limit).all()
+@app.get("/prescriptions", response_model=List[PrescriptionWithPatient])
+def get_prescriptions(skip: int = 0, limit: int = 100, include_deleted: bool = False, fields: Optional[str] = None,
+                      expand: Optional[str] = None, prescribed_by_id: Optional[int] = None,
+                      db: Session = Depends(get_read_db), actor: str = Depends(get_actor)):
+    names = parse_fields(fields, Prescription, PrescriptionResponse)
+    expand_patient = parse_expand(expand)
+    if names:
+        query = query_fields(db, Prescription, names, required=("id", "patient_id"))
+        if expand_patient:
+            query = with_patient_columns(query, Prescription)
+    else:
+        query = load_patient(db.query(Prescription), Prescription, expand_patient)
+    if not include_deleted:
+        query = query.filter(Prescription.deleted_at.is_(None), patient_not_deleted(Prescription.patient_id))
+    if prescribed_by_id is not None:
+        query = query.filter(Prescription.prescribed_by_id == prescribed_by_id)
+    prescriptions = query.offset(skip).limit(limit).all()
+    for prescription in prescriptions:
+        audit_log.record("read", "prescription", prescription.id, prescription.patient_id, actor)
+    if names:
+        return sparse_response(prescriptions, names, expand_patient)
     return prescriptions
 
 @app.get("/prescriptions/{prescription_id}", response_model=PrescriptionResponse)
-def get_prescription(prescription_id: int, db: Session = Depends(get_db)):
-    prescription = db.query(Prescription).filter(Prescription.id == prescription_id).first()
+def get_prescription(prescription_id: int, fields: Optional[str] = None, db: Session = Depends(get_read_db),
+                     actor: str = Depends(get_actor)):
+    names = parse_fields(fields, Prescription, PrescriptionResponse)
+    prescription = query_fields(db, Prescription, names, required=("id", "patient_id")).filter(
+        Prescription.id == prescription_id, Prescription.deleted_at.is_(None), patient_not_deleted(Prescription.patient_id)
+    ).first()
     if not prescription:
         raise HTTPException(status_code=404, detail="Prescription not found")
+    audit_log.record("read", "prescription", prescription.id, prescription.patient_id, actor)
+    if names:
+        return sparse_response(prescription, names)
     return prescription
 
 @app.put("/prescriptions/{prescription_id}", response_model=PrescriptionResponse)
-def update_prescription(prescription_id: int, prescription_update: PrescriptionUpdate, db: Session = Depends(get_db)):
-    db_prescription = db.query(Prescription).filter(Prescription.id == prescription_id).first()
+def update_prescription(prescription_id: int, prescription_update: PrescriptionUpdate, db: Session = Depends(get_db),
+                        actor: str = Depends(get_actor)):
+    db_prescription = db.query(Prescription).filter(Prescription.id == prescription_id, Prescription.deleted_at.is_(None)).first()
     if not db_prescription:
         raise HTTPException(status_code=404, detail="Prescription not found")
     
-    # Update fields
-    for field, value in prescription_update.dict(exclude_unset=True).items():
+    # Update fields, moving the prescription to its new rollup bucket
+    track_prescription(db, db_prescription, -1)
+    updates = link_staff(prescription_update.dict(exclude_unset=True), "prescribed_by", "prescribed_by_id")
+    for field, value in updates.items():
         setattr(db_prescription, field, value)
+    track_prescription(db, db_prescription, 1)
     
     db.commit()
     db.refresh(db_prescription)
+    audit_log.record("update", "prescription", db_prescription.id, db_prescription.patient_id, actor)
     return db_prescription
 
 @app.delete("/prescriptions/{prescription_id}")
-def delete_prescription(prescription_id: int, db: Session = Depends(get_db)):
-    prescription = db.query(Prescription).filter(Prescription.id == prescription_id).first()
+def delete_prescription(prescription_id: int, db: Session = Depends(get_db), actor: str = Depends(get_actor)):
+    prescription = db.query(Prescription).filter(Prescription.id == prescription_id, Prescription.deleted_at.is_(None)).first()
     if not prescription:
         raise HTTPException(status_code=404, detail="Prescription not found")
     
-    db.delete(prescription)
+    prescription.deleted_at = datetime.utcnow()
+    track_prescription(db, prescription, -1)
     db.commit()
+    audit_log.record("delete", "prescription", prescription.id, prescription.patient_id, actor)
     return {"message": "Prescription deleted successfully"}
 
-# Authentication routes
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+# Analytics routes: these only read the rollup tables, never the raw rows
+NO_SHOW_STATUSES = ("No Show", "No-Show")
+# The app has no no-show status: an appointment still Scheduled after its date was missed
+MISSED_STATUS = "No Show"
+
+def rollup_missing(db: Session, rollup_model, source_models) -> bool:
+    """True if a rollup table is empty although its source tables have live rows."""
+    if db.query(rollup_model).first() is not None:
+        return False
+    return any(db.query(model.id).filter(model.deleted_at.is_(None)).first() is not None for model in source_models)
+
+@app.on_event("startup")
+def populate_rollups():
+    # Databases created before the rollups existed (or whose rollup table was
+    # dropped by an upgrade) get them built once
+    db = SessionLocal()
+    try:
+        if (rollup_missing(db, AppointmentDailyRollup, (Appointment, ArchivedAppointment))
+                or rollup_missing(db, PrescriptionDailyRollup, (Prescription,))):
+            rebuild_rollups(db)
+    finally:
+        db.close()
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+def filter_rollup_doctor(query, doctor_id: Optional[int], doctor: Optional[str]):
+    """Limit appointment rollups to one doctor, given by user id or by a name matched to a user."""
+    if doctor_id is None and doctor:
+        doctor_id = staff_directory.resolve(doctor)
+        if doctor_id is None:
+            # Only appointments that were never linked to a user can still match by name
+            return query.filter(AppointmentDailyRollup.doctor_id == 0, AppointmentDailyRollup.doctor == doctor)
+    if doctor_id is not None:
+        query = query.filter(AppointmentDailyRollup.doctor_id == doctor_id)
+    return query
+
+def rollup_doctor_name(doctor_id: int, doctor: str) -> str:
+    if not doctor_id:
+        return doctor
+    return staff_directory.name(doctor_id) or f"Unknown doctor ({doctor_id})"
+
+@app.get("/analytics/appointments/daily", response_model=List[AppointmentVolume])
+def get_appointment_volume(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                           doctor: Optional[str] = None, doctor_id: Optional[int] = None,
+                           db: Session = Depends(get_read_db)):
+    query = filter_dates(db.query(AppointmentDailyRollup), AppointmentDailyRollup, date_from, date_to)
+    query = filter_rollup_doctor(query, doctor_id, doctor)
+    
+    volume = {}
+    for row in query.filter(AppointmentDailyRollup.count > 0).order_by(AppointmentDailyRollup.date):
+        entry = volume.setdefault((row.doctor_id, row.doctor, row.date), {
+            "doctor": rollup_doctor_name(row.doctor_id, row.doctor),
+            "doctor_id": row.doctor_id or None,
+            "date": row.date,
+            "total": 0,
+            "by_status": {},
+        })
+        entry["total"] += row.count
+        entry["by_status"][row.status] = row.count
+    return sorted(volume.values(), key=lambda entry: (entry["date"], entry["doctor"]))
+
+@app.get("/analytics/appointments/rates", response_model=List[AppointmentRates])
+def get_appointment_rates(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                          doctor_id: Optional[int] = None, db: Session = Depends(get_read_db)):
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    appointment_status = case(
+        (and_(AppointmentDailyRollup.status == "Scheduled", AppointmentDailyRollup.date < today), MISSED_STATUS),
+        else_=AppointmentDailyRollup.status,
+    )
+    query = db.query(
+        AppointmentDailyRollup.doctor_id, AppointmentDailyRollup.doctor, appointment_status,
+        func.sum(AppointmentDailyRollup.count),
+    ).filter(AppointmentDailyRollup.count > 0).group_by(
+        AppointmentDailyRollup.doctor_id, AppointmentDailyRollup.doctor, appointment_status
+    )
+    query = filter_dates(query, AppointmentDailyRollup, date_from, date_to)
+    query = filter_rollup_doctor(query, doctor_id, None)
+    
+    counts = {}
+    for row_doctor_id, doctor, appointment_status, count in query:
+        counts.setdefault((row_doctor_id, doctor), {})[appointment_status] = count
+    
+    rates = []
+    for (row_doctor_id, doctor), by_status in counts.items():
+        total = sum(by_status.values())
+        if total <= 0:
+            continue
+        cancelled = by_status.get("Cancelled", 0)
+        no_show = sum(by_status.get(name, 0) for name in NO_SHOW_STATUSES)
+        rates.append({
+            "doctor": rollup_doctor_name(row_doctor_id, doctor),
+            "doctor_id": row_doctor_id or None,
+            "total": total,
+            "completed": by_status.get("Completed", 0),
+            "cancelled": cancelled,
+            "no_show": no_show,
+            "cancellation_rate": cancelled / total,
+            "no_show_rate": no_show / total,
+        })
+    return sorted(rates, key=lambda entry: entry["doctor"])
+
+@app.get("/analytics/prescriptions/medications", response_model=List[MedicationCount])
+def get_medication_counts(date_from: Optional[str] = None, date_to: Optional[str] = None,
+                          db: Session = Depends(get_read_db)):
+    query = db.query(
+        PrescriptionDailyRollup.medication, PrescriptionDailyRollup.status, func.sum(PrescriptionDailyRollup.count)
+    ).filter(PrescriptionDailyRollup.count > 0).group_by(PrescriptionDailyRollup.medication, PrescriptionDailyRollup.status)
+    query = filter_dates(query, PrescriptionDailyRollup, date_from, date_to)
+    
+    medications = {}
+    for medication, prescription_status, count in query:
+        entry = medications.setdefault(medication, {"medication": medication, "total": 0, "by_status": {}})
+        entry["total"] += count
+        entry["by_status"][prescription_status] = count
+    return sorted(
+        (entry for entry in medications.values() if entry["total"] > 0),
+        key=lambda entry: entry["total"],
+        reverse=True,
+    )
+
+# Audit routes
+@app.on_event("startup")
+def start_audit_log():
+    audit_log.start()
+
+@app.on_event("shutdown")
+def stop_audit_log():
+    audit_log.stop()
+
+@app.get("/audit", response_model=List[AuditEventResponse])
+def get_audit_events(actor: Optional[str] = None, patient_id: Optional[int] = None,
+                     resource_type: Optional[str] = None, since: Optional[datetime] = None,
+                     until: Optional[datetime] = None, skip: int = 0, limit: int = 100,
+                     admin: User = Depends(get_current_admin)):
+    db = AuditSessionLocal()
+    try:
+        query = db.query(AuditEvent)
+        if actor:
+            query = query.filter(AuditEvent.actor == actor)
+        if patient_id is not None:
+            query = query.filter(AuditEvent.patient_id == patient_id)
+        if resource_type:
+            query = query.filter(AuditEvent.resource_type == resource_type)
+        if since:
+            query = query.filter(AuditEvent.occurred_at >= since)
+        if until:
+            query = query.filter(AuditEvent.occurred_at < until)
+        return query.order_by(AuditEvent.occurred_at.desc()).offset(skip).limit(limit).all()
+    finally:
+        db.close()
+
+# Background job routes
+JOB_RESULTS_DIR = os.getenv("JOB_RESULTS_DIR", "./job_results")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+job_queue = JobQueue(SQLALCHEMY_DATABASE_URL, JOB_RESULTS_DIR, max_workers=JOB_WORKERS)
 
+@app.on_event("startup")
+def start_job_queue():
+    job_queue.start()
+    # Jobs interrupted by a restart are queued again
+    db = SessionLocal()
+    try:
+        db.query(Job).filter(Job.status == "running").update({"status": "queued"})
+        db.commit()
+        for job in db.query(Job).filter(Job.status == "queued").order_by(Job.id).all():
+            job_queue.submit(job.id, job.kind, json.loads(job.params))
+    finally:
+        db.close()
+
+@app.on_event("shutdown")
+def stop_job_queue():
+    job_queue.shutdown()
+
+# Exports of these tables are audited, once when requested and once per download;
+# the event's resource_id is the job id
+AUDITED_EXPORTS = {"medical_records": "medical_record", "prescriptions": "prescription"}
+
+def audited_export(job) -> Optional[str]:
+    """Audit resource type of an export job, or None if it is not audited."""
+    if job.kind != "export":
+        return None
+    return AUDITED_EXPORTS.get(json.loads(job.params or "{}").get("table"))
+
+# Backups contain every table, users' password hashes included, so only
+# Administrators may queue them or download their results
+ADMIN_JOB_KINDS = ("backup",)
+
+@app.post("/jobs", response_model=JobResponse, status_code=202)
+def create_job(job: JobCreate, db: Session = Depends(get_db), actor: str = Depends(get_actor),
+               token: Optional[str] = Depends(optional_oauth2_scheme)):
+    if job.kind not in JOB_FUNCTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown job kind: {job.kind}")
+    if job.kind in ADMIN_JOB_KINDS:
+        admin_user(db, token)
+    return queue_job(db, job, actor)
+
+def queue_job(db: Session, job: JobCreate, actor: str):
+    db_job = Job(kind=job.kind, params=json.dumps(job.params))
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    
+    resource_type = audited_export(db_job)
+    if resource_type:
+        audit_log.record("export", resource_type, db_job.id, None, actor)
+    job_queue.submit(db_job.id, db_job.kind, job.params)
+    return db_job
+
+# Job status is read from the primary because workers update it there
+@app.get("/jobs", response_model=List[JobResponse])
+def get_jobs(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    jobs = db.query(Job).order_by(Job.id.desc()).offset(skip).limit(limit).all()
+    return jobs
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+def get_job(job_id: int, db: Session = Depends(get_db)):
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/jobs/{job_id}/cancel", response_model=JobResponse)
+def cancel_job(job_id: int, db: Session = Depends(get_db)):
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    # Running jobs stop at their next progress report
+    if job.status in ("queued", "running"):
+        job.cancel_requested = True
+    if job.status == "queued":
+        job.status = "cancelled"
+        job.finished_at = datetime.utcnow()
+    db.commit()
+    db.refresh(job)
+    return job
+
+@app.get("/jobs/{job_id}/result")
+def get_job_result(job_id: int, db: Session = Depends(get_db), actor: str = Depends(get_actor),
+                   token: Optional[str] = Depends(optional_oauth2_scheme)):
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.kind in ADMIN_JOB_KINDS:
+        admin_user(db, token)
+    if job.status != "completed" or not job.result_path or not os.path.exists(job.result_path):
+        raise HTTPException(status_code=409, detail=f"Job result not available (status: {job.status})")
+    resource_type = audited_export(job)
+    if resource_type:
+        audit_log.record("download", resource_type, job.id, None, actor)
+    return FileResponse(job.result_path, filename=os.path.basename(job.result_path))
+
+# Delta sync for offline clients: /sync returns patients and appointments
+# changed since a token, read through the updated_at indexes, plus tombstones
+# for deleted ones. The token is an opaque cursor into all three streams.
+SYNC_PAGE_SIZE = 500
+MAX_SYNC_PAGE_SIZE = 2000
+# Rows only become visible once their updated_at is this old, so that a write
+# committed just after a page was read cannot land behind the cursor
+SYNC_SAFETY_SECONDS = float(os.getenv("SYNC_SAFETY_SECONDS", "5"))
+SYNC_TOMBSTONE_RETENTION_DAYS = int(os.getenv("SYNC_TOMBSTONE_RETENTION_DAYS", "90"))
+SYNC_MODELS = {"patients": Patient, "appointments": Appointment}
+
+def encode_sync_token(cursor: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(cursor, separators=(",", ":")).encode()).decode()
+
+def decode_sync_token(token: str) -> dict:
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(token.encode()))
+        datetime.fromisoformat(cursor["issued"])
+        for name in SYNC_MODELS:
+            if cursor[name] is not None:
+                datetime.fromisoformat(cursor[name][0])
+                int(cursor[name][1])
+        int(cursor["deleted"])
+    except (ValueError, TypeError, KeyError, IndexError):
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    return cursor
+
+def changed_rows(db: Session, model, position, horizon: datetime, limit: int):
+    """Live rows updated after `position` ([updated_at, id]) and no later than `horizon`."""
+    query = db.query(model).filter(model.deleted_at.is_(None), model.updated_at <= horizon)
+    if model is not Patient:
+        # Rows of a soft-deleted patient are hidden like on the list routes
+        query = query.filter(patient_not_deleted(model.patient_id))
+    if position is not None:
+        updated_at, last_id = datetime.fromisoformat(position[0]), position[1]
+        query = query.filter(or_(
+            model.updated_at > updated_at,
+            and_(model.updated_at == updated_at, model.id > last_id),
+        ))
+    return query.order_by(model.updated_at, model.id).limit(limit).all()
+
+@app.on_event("startup")
+def prepare_sync():
+    db = SessionLocal()
+    try:
+        # Rows written before updated_at existed would never be picked up by a delta
+        for model in SYNC_MODELS.values():
+            db.query(model).filter(model.updated_at.is_(None)).update(
+                {"updated_at": func.coalesce(model.created_at, datetime.utcnow())}, synchronize_session=False
+            )
+        cutoff = datetime.utcnow() - timedelta(days=SYNC_TOMBSTONE_RETENTION_DAYS)
+        # The tombstone with the highest id stays: SQLite hands out max(id)+1, so an
+        # emptied table would reuse ids that clients' tokens have already passed
+        max_id = db.query(func.max(SyncTombstone.id)).scalar()
+        if max_id is not None:
+            db.query(SyncTombstone).filter(SyncTombstone.deleted_at < cutoff, SyncTombstone.id < max_id).delete()
+        db.commit()
+    finally:
+        db.close()
+
+# Read from the primary: a lagging replica could let rows slip behind the cursor
+@app.get("/sync", response_model=SyncResponse)
+def sync_changes(since: Optional[str] = None, limit: int = SYNC_PAGE_SIZE, db: Session = Depends(get_db)):
+    limit = max(1, min(limit, MAX_SYNC_PAGE_SIZE))
+    now = datetime.utcnow()
+    horizon = now - timedelta(seconds=SYNC_SAFETY_SECONDS)
+    if since:
+        cursor = decode_sync_token(since)
+        if datetime.fromisoformat(cursor["issued"]) < now - timedelta(days=SYNC_TOMBSTONE_RETENTION_DAYS):
+            raise HTTPException(status_code=410, detail="Sync token expired, sync again without since")
+    else:
+        # First sync: every live row, and no tombstones for rows the client never had
+        cursor = {name: None for name in SYNC_MODELS}
+        cursor["deleted"] = db.query(func.max(SyncTombstone.id)).scalar() or 0
+    
+    changes = {}
+    for name, model in SYNC_MODELS.items():
+        rows = changed_rows(db, model, cursor[name], horizon, limit)
+        if rows:
+            cursor[name] = [rows[-1].updated_at.isoformat(), rows[-1].id]
+        changes[name] = rows
+    deleted = db.query(SyncTombstone).filter(SyncTombstone.id > cursor["deleted"]).order_by(
+        SyncTombstone.id
+    ).limit(limit).all()
+    if deleted:
+        cursor["deleted"] = deleted[-1].id
+    cursor["issued"] = horizon.isoformat()
+    
+    return {
+        **changes,
+        "deleted": deleted,
+        "next_token": encode_sync_token(cursor),
+        "has_more": any(len(rows) == limit for rows in [*changes.values(), deleted]),
+    }
+
+# Admin routes
+@app.post("/admin/backup", response_model=JobResponse, status_code=202)
+def create_backup_job(compress: bool = True, db: Session = Depends(get_db), actor: str = Depends(get_actor),
+                      admin: User = Depends(get_current_admin)):
+    """Queue an online snapshot of the database; download it from /jobs/{id}/result once completed."""
+    return queue_job(db, JobCreate(kind="backup", params={"compress": compress}), actor)
+
+# Authentication routes
 class Token(BaseModel):
     access_token: str
     token_type: str
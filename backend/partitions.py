@@ -0,0 +1,135 @@
+"""
+Year partitions for medical records and appointments.
+Moves every row dated in a closed year, live and archived alike, out of the
+main database into partitions/<year>.db. The API attaches a partition only
+when a request's date range overlaps its year. Detaching a cold partition
+moves its file to partitions/detached/ so the API stops reading it; it can be
+backed up or moved off the server and attached again later.
+
+Usage: python partitions.py create YEAR [--batch-size 500]
+       python partitions.py list
+       python partitions.py detach YEAR
+       python partitions.py attach YEAR
+"""
+
+import argparse
+import os
+from datetime import datetime
+
+from sqlalchemy import and_, delete, func, insert, select, text
+
+from main import (
+    Base, SessionLocal, MedicalRecord, Appointment, PARTITIONS_DIR, DETACHED_PARTITIONS_DIR, PARTITIONED_MODELS,
+    attach_partitions, ensure_columns, partition_engine, partition_path, partition_table, partition_years,
+)
+
+def move_year(db, model, year: int, batch_size: int) -> int:
+    """Move the model's rows dated in `year` into its partition, in batches."""
+    table = partition_table(model, year)
+    names = [column.name for column in model.__table__.columns]
+    condition = and_(model.date >= f"{year}-01-01", model.date < f"{year + 1}-01-01")
+    if model in (MedicalRecord, Appointment):
+        # SQLite reuses the highest id once its row is gone, so that row stays behind
+        max_id = db.execute(select(func.max(model.id))).scalar()
+        condition = and_(condition, model.id < max_id) if max_id is not None else condition
+    moved = 0
+
+    while True:
+        # Committing releases the connection, so make sure the one we get next has the partition
+        attach_partitions(db, [year])
+        ids = db.execute(select(model.id).where(condition).order_by(model.id).limit(batch_size)).scalars().all()
+        if not ids:
+            break
+        rows = select(*[model.__table__.c[name] for name in names]).where(model.id.in_(ids))
+        # OR REPLACE: in WAL mode a crash can commit the copy without the delete, and a rerun must not fail
+        db.execute(insert(table).prefix_with("OR REPLACE").from_select(names, rows))
+        db.execute(delete(model).where(model.id.in_(ids)))
+        db.commit()
+        moved += len(ids)
+
+    return moved
+
+def create_partition(year: int, batch_size: int = 500) -> dict:
+    """Create (or top up) the partition for a closed year and return the rows moved per table."""
+    if year >= datetime.utcnow().year:
+        raise ValueError("Only years that have ended can be partitioned")
+    if os.path.exists(partition_path(year, DETACHED_PARTITIONS_DIR)):
+        raise ValueError(f"Partition {year} is detached, attach it first")
+
+    os.makedirs(PARTITIONS_DIR, exist_ok=True)
+    engine = partition_engine(year)
+    try:
+        Base.metadata.create_all(bind=engine, tables=[model.__table__ for model in PARTITIONED_MODELS])
+        ensure_columns(engine)
+    finally:
+        engine.dispose()
+
+    db = SessionLocal()
+    try:
+        return {model.__tablename__: move_year(db, model, year, batch_size) for model in PARTITIONED_MODELS}
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def list_partitions() -> list:
+    """Row counts and file size for every active and detached partition."""
+    partitions = []
+    for state, directory in (("active", PARTITIONS_DIR), ("detached", DETACHED_PARTITIONS_DIR)):
+        for year in partition_years(directory):
+            engine = partition_engine(year, directory)
+            try:
+                with engine.connect() as conn:
+                    rows = {
+                        model.__tablename__: conn.execute(text(f"SELECT COUNT(*) FROM {model.__tablename__}")).scalar()
+                        for model in PARTITIONED_MODELS
+                    }
+            finally:
+                engine.dispose()
+            partitions.append({
+                "year": year,
+                "state": state,
+                "size_bytes": os.path.getsize(partition_path(year, directory)),
+                "rows": rows,
+            })
+    return partitions
+
+def detach_partition(year: int):
+    if not os.path.exists(partition_path(year)):
+        raise ValueError(f"No active partition for {year}")
+    os.makedirs(DETACHED_PARTITIONS_DIR, exist_ok=True)
+    os.replace(partition_path(year), partition_path(year, DETACHED_PARTITIONS_DIR))
+
+def attach_partition(year: int):
+    if not os.path.exists(partition_path(year, DETACHED_PARTITIONS_DIR)):
+        raise ValueError(f"No detached partition for {year}")
+    os.replace(partition_path(year, DETACHED_PARTITIONS_DIR), partition_path(year))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage year partitions of medical records and appointments")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="Move a closed year out of the main database")
+    create.add_argument("year", type=int)
+    create.add_argument("--batch-size", type=int, default=500, help="Rows moved per transaction")
+    commands.add_parser("list", help="Show active and detached partitions")
+    commands.add_parser("detach", help="Stop the API from reading a partition").add_argument("year", type=int)
+    commands.add_parser("attach", help="Make a detached partition readable again").add_argument("year", type=int)
+    args = parser.parse_args()
+
+    try:
+        if args.command == "create":
+            for table, moved in create_partition(args.year, args.batch_size).items():
+                print(f"Moved {moved} rows from {table} to partition {args.year}")
+        elif args.command == "list":
+            for partition in list_partitions():
+                counts = ", ".join(f"{table}={count}" for table, count in partition["rows"].items())
+                print(f"{partition['year']} {partition['state']} {partition['size_bytes']} bytes: {counts}")
+        elif args.command == "detach":
+            detach_partition(args.year)
+            print(f"Partition {args.year} detached")
+        else:
+            attach_partition(args.year)
+            print(f"Partition {args.year} attached")
+    except ValueError as exc:
+        parser.exit(1, f"{exc}\n")
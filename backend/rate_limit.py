@@ -0,0 +1,134 @@
+"""
+Rate limiting and admission control for the Hospital Management System API.
+Token buckets per client and route category, plus a global concurrency cap.
+"""
+
+import math
+import time
+from collections import OrderedDict
+
+from jose import JWTError, jwt
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+
+READ_METHODS = {"GET", "HEAD"}
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `rate` tokens per second."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = now
+
+    def consume(self, now: float) -> float:
+        """Take one token. Return 0 on success, else the seconds to wait."""
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Keeps one bucket per (client, category), evicting the least recently used."""
+
+    def __init__(self, budgets: dict, max_clients: int = 10000):
+        # budgets maps a category to (requests per minute, burst size)
+        self.budgets = budgets
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+
+    def hit(self, client: str, category: str, now: float = None) -> float:
+        if category not in self.budgets:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        key = (client, category)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            per_minute, burst = self.budgets[category]
+            bucket = TokenBucket(per_minute / 60.0, burst, now)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.consume(now)
+
+
+def route_category(method: str, path: str) -> str:
+    if path.rstrip("/") == "/token":
+        return "token"
+    if method in READ_METHODS:
+        return "read"
+    return "write"
+
+
+def make_client_key(secret_key: str, algorithm: str):
+    """Build a key function using the JWT subject, falling back to the client IP."""
+
+    def client_key(scope) -> str:
+        authorization = Headers(scope=scope).get("authorization", "")
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() == "bearer" and token:
+            try:
+                payload = jwt.decode(token, secret_key, algorithms=[algorithm])
+                subject = payload.get("sub")
+                if subject:
+                    return f"user:{subject}"
+            except JWTError:
+                pass
+        client = scope.get("client")
+        return f"ip:{client[0]}" if client else "ip:unknown"
+
+    return client_key
+
+
+class RateLimitMiddleware:
+    """Reject requests over budget with 429 and shed load with 503 when saturated."""
+
+    def __init__(self, app, limiter: RateLimiter, key_func, max_concurrency: int = 64):
+        self.app = app
+        self.limiter = limiter
+        self.key_func = key_func
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+
+    async def __call__(self, scope, receive, send):
+        # CORS preflight requests are cheap and must not eat into the budget
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        if self.max_concurrency and self.in_flight >= self.max_concurrency:
+            response = JSONResponse(
+                {"detail": "Server is busy, please retry shortly"},
+                status_code=503,
+                headers={"Retry-After": "1"},
+            )
+            await response(scope, receive, send)
+            return
+
+        category = route_category(scope["method"], scope["path"])
+        wait = self.limiter.hit(self.key_func(scope), category)
+        if wait > 0:
+            response = JSONResponse(
+                {"detail": "Rate limit exceeded"},
+                status_code=429,
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+            await response(scope, receive, send)
+            return
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
@@ -0,0 +1,20 @@
+"""
+Rebuilds the analytics rollup tables of the Hospital Management System from
+the appointments, archived appointments and prescriptions tables.
+
+Usage: python rebuild_rollups.py
+"""
+
+from main import SessionLocal, AppointmentDailyRollup, PrescriptionDailyRollup, rebuild_rollups
+
+if __name__ == "__main__":
+    db = SessionLocal()
+    try:
+        rebuild_rollups(db)
+        print(f"Appointment rollup rows: {db.query(AppointmentDailyRollup).count()}")
+        print(f"Prescription rollup rows: {db.query(PrescriptionDailyRollup).count()}")
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
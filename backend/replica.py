@@ -0,0 +1,61 @@
+"""
+Read-replica support for the Hospital Management System API.
+Tracks recent writers for read-your-writes routing and can keep a local
+SQLite replica in sync with the primary for development and testing.
+
+Usage: python replica.py PRIMARY.db REPLICA.db [--interval SECONDS]
+"""
+
+import argparse
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class ReadYourWritesTracker:
+    """Remember which clients wrote recently so their reads go to the primary."""
+
+    def __init__(self, window_seconds: float = 5.0, max_clients: int = 10000):
+        self.window_seconds = window_seconds
+        self.max_clients = max_clients
+        self._last_write = OrderedDict()
+        self._lock = threading.Lock()
+
+    def mark_write(self, client: str):
+        with self._lock:
+            self._last_write[client] = time.monotonic()
+            self._last_write.move_to_end(client)
+            if len(self._last_write) > self.max_clients:
+                self._last_write.popitem(last=False)
+
+    def wrote_recently(self, client: str) -> bool:
+        with self._lock:
+            last_write = self._last_write.get(client)
+        return last_write is not None and time.monotonic() - last_write < self.window_seconds
+
+
+def sync_replica(primary_path: str, replica_path: str, pages_per_step: int = 1024):
+    """Copy the primary database into the replica with SQLite's online backup API."""
+    source = sqlite3.connect(primary_path)
+    target = sqlite3.connect(replica_path)
+    try:
+        source.backup(target, pages=pages_per_step)
+    finally:
+        target.close()
+        source.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep a local SQLite read replica in sync")
+    parser.add_argument("primary", help="Path to the primary database")
+    parser.add_argument("replica", help="Path to the replica database")
+    parser.add_argument("--interval", type=float, default=0, help="Seconds between syncs (0 = sync once)")
+    args = parser.parse_args()
+
+    while True:
+        sync_replica(args.primary, args.replica)
+        print(f"Replica {args.replica} synced from {args.primary}")
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
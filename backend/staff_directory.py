@@ -0,0 +1,99 @@
+"""
+In-process staff directory for the Hospital Management System API.
+Keeps user ids and names in memory so that responses can show the current
+name of the doctor a row refers to without joining users on every query,
+and so that free-text doctor names can be matched to a user.
+"""
+
+import re
+import threading
+import time
+
+
+def normalize_name(name: str) -> str:
+    """Lower-case a name and drop punctuation, extra spaces and a leading "Dr"/"Doctor"."""
+    words = re.sub(r"[.,]", " ", (name or "").lower()).split()
+    if words and words[0] in ("dr", "doctor"):
+        words = words[1:]
+    return " ".join(words)
+
+
+class StaffDirectory:
+    """Cache of `model` (users) ids and names, reloaded by `refresh()`.
+
+    The API refreshes it whenever a user is created, updated or deleted; the
+    `ttl` reload picks up changes made by other processes.
+    """
+
+    def __init__(self, session_factory, model, ttl: float = 300.0):
+        self.session_factory = session_factory
+        self.model = model
+        self.ttl = ttl
+        self._names = {}
+        self._ids_by_name = {}
+        self._doctors_by_surname = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        db = self.session_factory()
+        try:
+            users = db.query(self.model.id, self.model.name, self.model.role).all()
+        finally:
+            db.close()
+
+        names = {}
+        candidates = {}
+        for user_id, name, role in users:
+            names[user_id] = name
+            candidates.setdefault(normalize_name(name), []).append((user_id, role))
+        ids_by_name = {}
+        for key, matches in candidates.items():
+            # A name shared by several users only resolves if exactly one of them is a doctor
+            doctors = [user_id for user_id, role in matches if role == "Doctor"]
+            if len(matches) == 1:
+                ids_by_name[key] = matches[0][0]
+            elif len(doctors) == 1:
+                ids_by_name[key] = doctors[0]
+        # Surnames of doctors, for suggesting who a bare "Dr Smith" might be
+        doctors_by_surname = {}
+        for user_id, name, role in users:
+            words = normalize_name(name).split()
+            if role == "Doctor" and len(words) > 1:
+                doctors_by_surname.setdefault(words[-1], []).append(user_id)
+
+        with self._lock:
+            self._names = names
+            self._ids_by_name = ids_by_name
+            self._doctors_by_surname = doctors_by_surname
+            self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            self.refresh()
+
+    def name(self, user_id):
+        """Current name of a user, or None if the id is unknown."""
+        if user_id is None:
+            return None
+        self._ensure_loaded()
+        return self._names.get(user_id)
+
+    def resolve(self, name):
+        """Id of the user a free-text name refers to, or None if there is no unambiguous match."""
+        if not name:
+            return None
+        self._ensure_loaded()
+        return self._ids_by_name.get(normalize_name(name))
+
+    def suggest(self, name):
+        """Id of the only doctor whose surname is the whole of `name` ("Dr Smith"), or None.
+
+        Only a suggestion for a person to confirm: it is never used to link rows.
+        """
+        key = normalize_name(name)
+        if not key or " " in key:
+            return None
+        self._ensure_loaded()
+        doctors = self._doctors_by_surname.get(key, [])
+        return doctors[0] if len(doctors) == 1 else None